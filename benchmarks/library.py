@@ -0,0 +1,130 @@
+import zlib
+from dataclasses import dataclass
+
+PRESETS = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+
+
+@dataclass
+class LibraryConfig:
+    artists: int = 1_000
+    albums_per_artist: int = 3
+    tracks_per_album: int = 10
+    playlists: int | None = None
+    tracks_per_playlist: int = 50
+    categories: int = 20
+    lidarr_artist_ratio: float = 0.9
+    lidarr_album_ratio: float = 0.5
+    monitored_ratio: float = 0.8
+    navidrome_album_ratio: float = 0.7
+    seed: int = 0
+
+    def __post_init__(self):
+        if self.playlists is None:
+            self.playlists = max(1, self.artists // 2)
+
+
+class SyntheticLibrary:
+    """Deterministic music library described by a handful of ratios.
+
+    Nothing is stored per track: every property is derived from a hash of
+    the seed and the entity's indexes, so a 100k-artist library costs the
+    same memory as a small one. Artists are identified by k, albums by
+    (k, a) and tracks by (k, a, t). Playlists draw tracks with a bias
+    towards low artist indexes, so popular tracks recur across playlists as
+    they do on Spotify.
+    """
+
+    def __init__(self, config: LibraryConfig):
+        self.config = config
+        self._navidrome_albums = None
+
+    def _unit(self, *key):
+        digest = zlib.crc32(repr((self.config.seed, key)).encode())
+        return digest / 0xFFFFFFFF
+
+    def _chance(self, ratio, *key):
+        return self._unit(*key) < ratio
+
+    def _pick(self, count, *key, skew=1.0):
+        return min(count - 1, int(count * self._unit(*key) ** skew))
+
+    # Names shared by every service, so lookups across services match.
+    def artist_name(self, k):
+        return f"Artist {k}"
+
+    def album_title(self, k, a):
+        return f"Album {k}-{a}"
+
+    def track_title(self, k, a, t):
+        return f"Track {k}-{a}-{t}"
+
+    def artist_in_lidarr(self, k):
+        return self._chance(self.config.lidarr_artist_ratio, "lidarr", k)
+
+    def artist_monitored(self, k):
+        return self._chance(self.config.monitored_ratio, "artist-monitored", k)
+
+    def album_in_lidarr(self, k, a):
+        return self.artist_in_lidarr(k) and self._chance(
+            self.config.lidarr_album_ratio, "lidarr", k, a
+        )
+
+    def album_monitored(self, k, a):
+        return self._chance(self.config.monitored_ratio, "album-monitored", k, a)
+
+    def album_in_navidrome(self, k, a):
+        return self._chance(self.config.navidrome_album_ratio, "navidrome", k, a)
+
+    def lidarr_artists(self):
+        return (k for k in range(self.config.artists) if self.artist_in_lidarr(k))
+
+    def lidarr_albums(self):
+        for k in self.lidarr_artists():
+            for a in range(self.config.albums_per_artist):
+                if self.album_in_lidarr(k, a):
+                    yield k, a
+
+    def navidrome_albums(self):
+        if self._navidrome_albums is None:
+            self._navidrome_albums = [
+                (k, a)
+                for k in range(self.config.artists)
+                for a in range(self.config.albums_per_artist)
+                if self.album_in_navidrome(k, a)
+            ]
+        return self._navidrome_albums
+
+    def navidrome_artists(self):
+        return sorted({k for k, _ in self.navidrome_albums()})
+
+    def navidrome_song_count(self):
+        return len(self.navidrome_albums()) * self.config.tracks_per_album
+
+    def navidrome_song(self, offset):
+        """(k, a, t) of the song at `offset` in the Navidrome catalog."""
+        k, a = self.navidrome_albums()[offset // self.config.tracks_per_album]
+        return k, a, offset % self.config.tracks_per_album
+
+    def playlist_tracks(self, p):
+        config = self.config
+        for i in range(config.tracks_per_playlist):
+            k = self._pick(config.artists, "playlist-artist", p, i, skew=2.0)
+            a = self._pick(config.albums_per_artist, "playlist-album", p, i)
+            t = self._pick(config.tracks_per_album, "playlist-track", p, i)
+            yield k, a, t
+
+    def artist_playlists(self, k, limit):
+        return list(
+            dict.fromkeys(
+                self._pick(self.config.playlists, "artist-playlist", k, j)
+                for j in range(limit)
+            )
+        )
+
+    def category_playlists(self, c, limit):
+        return list(
+            dict.fromkeys(
+                self._pick(self.config.playlists, "category-playlist", c, j)
+                for j in range(limit)
+            )
+        )
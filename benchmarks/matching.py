@@ -0,0 +1,97 @@
+"""Benchmark the fuzzy track matcher against a synthetic Navidrome catalog.
+
+    python benchmarks/matching.py --artists 10k --queries 100000 --processes 4
+
+Queries are drawn from the library like playlist tracks, and a share of
+them gets a version suffix or a featured artist, as Spotify titles do.
+The report gives the index build time and the matching throughput
+serially and on a process pool.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from library import PRESETS, LibraryConfig, SyntheticLibrary
+from matching import TrackMatcher
+from navidrome import NavidromeAlbum, NavidromeArtist, NavidromeTrack
+
+SUFFIXES = ("", "", " - Remastered 2011", " (feat. Guest)", " - Radio Edit", " (Live)")
+
+
+def build_matcher(library):
+    matcher = TrackMatcher()
+    for offset in range(library.navidrome_song_count()):
+        k, a, t = library.navidrome_song(offset)
+        artist = NavidromeArtist(_id=f"ar{k}", name=library.artist_name(k))
+        album = NavidromeAlbum(_id=f"al{k}-{a}", artist=artist)
+        track = NavidromeTrack(
+            _id=f"song{k}-{a}-{t}", title=library.track_title(k, a, t), album=album
+        )
+        matcher.add(track, (artist.name,), library.album_title(k, a))
+    return matcher
+
+
+def build_queries(library, count):
+    queries = []
+    playlist = 0
+    while len(queries) < count:
+        for k, a, t in library.playlist_tracks(playlist):
+            suffix = SUFFIXES[len(queries) % len(SUFFIXES)]
+            queries.append(
+                (
+                    library.artist_name(k),
+                    library.track_title(k, a, t) + suffix,
+                    library.album_title(k, a),
+                )
+            )
+        playlist += 1
+    return queries[:count]
+
+
+def timed(function, *args, **kwargs):
+    started_at = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started_at
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--artists",
+        default="10k",
+        help=f"library size, one of {', '.join(PRESETS)} or a number of artists",
+    )
+    parser.add_argument("--queries", type=int, default=100_000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    artists = PRESETS.get(args.artists) or int(args.artists)
+    library = SyntheticLibrary(LibraryConfig(artists=artists, seed=args.seed))
+
+    matcher, build_time = timed(build_matcher, library)
+    queries = build_queries(library, args.queries)
+    print(f"indexed {len(matcher)} songs in {build_time:.2f}s")
+
+    for processes in dict.fromkeys((1, args.processes)):
+        # Fresh matcher state, so every run computes its trigram blocks.
+        matcher.block_grams = {}
+        matches, match_time = timed(matcher.match_many, queries, processes)
+        matched = sum(1 for match in matches if match is not None)
+        print(
+            f"{processes} process(es): {len(queries)} queries in {match_time:.2f}s "
+            f"({len(queries) / match_time:,.0f}/s), {matched} matched"
+        )
+
+
+if __name__ == "__main__":
+    main()
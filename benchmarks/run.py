@@ -0,0 +1,317 @@
+"""Benchmark a full PlaylistManager run against local stub servers.
+
+    python benchmarks/run.py --artists 10k --mode threaded --latency 0.02
+
+Fake Spotify, Lidarr, Navidrome and MusicBrainz servers run in a separate
+process, so their CPU time does not count against the measured run. The
+report gives the wall time, the requests received per endpoint, the bytes
+sent and the peak memory traced by tracemalloc for each run.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import musicbrainzngs
+from artist_scan import ArtistScanStore
+from concurrency import ConcurrencyLimitedService
+from http_cache import HttpCache
+from library import PRESETS, LibraryConfig, SyntheticLibrary
+from lidarr import LidarrService
+from musicbrainz import MusicBrainzCache, MusicBrainzService
+from navidrome import NavidromeService
+from playlist import PlaylistManager
+from servers import LidarrApp, MusicBrainzApp, NavidromeApp, SpotifyApp, StubServer
+from spotify import SpotifyService
+from sync_state import SyncStateStore
+from track_mapping import TrackMappingStore
+from transport import HttpTransport
+
+APPS = {
+    "spotify": SpotifyApp,
+    "lidarr": LidarrApp,
+    "navidrome": NavidromeApp,
+    "musicbrainz": MusicBrainzApp,
+}
+
+
+def serve(library_config, server_options, connection):
+    """Run every stub server until told to stop, answering stats requests."""
+    library = SyntheticLibrary(library_config)
+    servers = {
+        name: StubServer(app(library), **server_options[name]).start()
+        for name, app in APPS.items()
+    }
+    connection.send({name: server.url for name, server in servers.items()})
+
+    while connection.recv() == "stats":
+        connection.send({name: server.stats() for name, server in servers.items()})
+
+    for server in servers.values():
+        server.stop()
+
+
+def build_manager(urls, args, data_dir):
+    transport = HttpTransport(pool_maxsize=max(10, args.workers * 2))
+
+    musicbrainz_host = urlparse(urls["musicbrainz"]).netloc
+    musicbrainzngs.set_hostname(musicbrainz_host, use_https=False)
+    musicbrainzngs.set_rate_limit(args.musicbrainz_client_interval or False)
+
+    spotify = SpotifyService(
+        client_id="benchmark",
+        client_secret="benchmark",
+        transport=transport,
+        max_concurrency=args.workers,
+        rate_limit=args.spotify_client_rate_limit,
+        rate_burst=args.spotify_client_rate_limit,
+        cache=(
+            HttpCache(os.path.join(data_dir, "http-cache.sqlite"))
+            if args.http_cache
+            else None
+        ),
+        api_url=urls["spotify"],
+        accounts_url=urls["spotify"],
+    )
+    musicbrainz = MusicBrainzService(
+        cache=MusicBrainzCache(os.path.join(data_dir, "musicbrainz.sqlite"))
+    )
+    lidarr = LidarrService(
+        lidarr_url=urls["lidarr"],
+        api_key="benchmark",
+        transport=transport,
+        musicbrainz=musicbrainz,
+    )
+    navidrome = NavidromeService(
+        navidrome_url=urls["navidrome"],
+        username="benchmark",
+        password="benchmark",
+        transport=transport,
+        catalog_path=os.path.join(data_dir, "navidrome-catalog.json"),
+    )
+
+    if args.mode != "sequential":
+        lidarr.musicbrainz = ConcurrencyLimitedService(musicbrainz, 1)
+        lidarr = ConcurrencyLimitedService(lidarr, args.workers)
+        navidrome = ConcurrencyLimitedService(navidrome, args.workers)
+
+    return PlaylistManager(
+        spotify=spotify,
+        lidarr=lidarr,
+        navidrome=navidrome,
+        artist_playlist_limit=args.artist_playlist_limit,
+        category_playlist_limit=args.category_playlist_limit,
+        included_categories=[],
+        excluded_categories=[],
+        random_category_limit=args.random_category_limit,
+        quality_profile_name="HQ",
+        metadata_profile_name="Standard",
+        sync_state=SyncStateStore(os.path.join(data_dir, "sync-state.json")),
+        artist_scan=(
+            ArtistScanStore(os.path.join(data_dir, "artist-scan.json"))
+            if args.incremental_artist_scan
+            else None
+        ),
+        track_mappings=TrackMappingStore(
+            os.path.join(data_dir, "track-mappings.sqlite")
+        ),
+        mode=args.mode,
+        workers=args.workers,
+    )
+
+
+def request_delta(before, after):
+    delta = {}
+    for name, stats in after.items():
+        previous = before.get(name, {}).get("requests", {})
+        for endpoint, count in stats["requests"].items():
+            if count - previous.get(endpoint, 0):
+                delta[f"{name} {endpoint}"] = count - previous.get(endpoint, 0)
+    return dict(sorted(delta.items()))
+
+
+def print_report(report):
+    print(
+        f"run {report['run']}: {report['wall_time']:.2f}s wall, "
+        f"{report['requests']} requests ({report['not_modified']} not modified, "
+        f"{report['sent_bytes'] / 2**20:.1f} MiB sent), "
+        f"peak memory {report['peak_memory'] / 2**20:.1f} MiB"
+    )
+    for endpoint, count in report["requests_by_endpoint"].items():
+        print(f"  {count:>8}  {endpoint}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--artists",
+        default="1k",
+        help=f"library size, one of {', '.join(PRESETS)} or a number of artists",
+    )
+    parser.add_argument("--albums-per-artist", type=int, default=3)
+    parser.add_argument("--tracks-per-album", type=int, default=10)
+    parser.add_argument("--tracks-per-playlist", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--mode", choices=("sequential", "async", "threaded"), default="sequential"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=1, help="runs sharing one state")
+    parser.add_argument("--artist-playlist-limit", type=int, default=3)
+    parser.add_argument("--category-playlist-limit", type=int, default=3)
+    parser.add_argument("--random-category-limit", type=int, default=5)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server latency in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="extra random latency in seconds"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of requests failing with 503",
+    )
+    for name in APPS:
+        parser.add_argument(
+            f"--{name}-rate-limit",
+            type=float,
+            help=f"{name} server requests per second before answering 429",
+        )
+    parser.add_argument(
+        "--spotify-client-rate-limit",
+        type=float,
+        default=10_000,
+        help="SpotifyService token bucket rate (production default is 10)",
+    )
+    parser.add_argument(
+        "--musicbrainz-client-interval",
+        type=float,
+        default=0,
+        help="musicbrainzngs client rate limit interval, 0 to disable",
+    )
+    parser.add_argument(
+        "--etags",
+        action="store_true",
+        help="servers send ETags and answer 304 to matching If-None-Match",
+    )
+    parser.add_argument(
+        "--http-cache",
+        action="store_true",
+        help="SpotifyService revalidates responses from an HttpCache",
+    )
+    parser.add_argument(
+        "--incremental-artist-scan",
+        action="store_true",
+        help="only scan new or changed Navidrome artists after the first run",
+    )
+    parser.add_argument(
+        "--no-tracemalloc",
+        action="store_true",
+        help="skip memory tracing, which slows the run down",
+    )
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(levelname)s - %(message)s"
+    )
+
+    artists = PRESETS.get(args.artists) or int(args.artists)
+    library_config = LibraryConfig(
+        artists=artists,
+        albums_per_artist=args.albums_per_artist,
+        tracks_per_album=args.tracks_per_album,
+        tracks_per_playlist=args.tracks_per_playlist,
+        seed=args.seed,
+    )
+    server_options = {
+        name: {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "rate_limit": getattr(args, f"{name}_rate_limit"),
+            "etags": args.etags,
+            "seed": args.seed,
+        }
+        for name in APPS
+    }
+
+    connection, server_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(
+        target=serve,
+        args=(library_config, server_options, server_connection),
+        daemon=True,
+    )
+    server_process.start()
+    urls = connection.recv()
+
+    reports = []
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            manager = build_manager(urls, args, data_dir)
+            for run in range(1, args.runs + 1):
+                connection.send("stats")
+                before = connection.recv()
+
+                if not args.no_tracemalloc:
+                    tracemalloc.start()
+                started_at = time.perf_counter()
+                manager.process()
+                wall_time = time.perf_counter() - started_at
+                peak_memory = 0
+                if not args.no_tracemalloc:
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                connection.send("stats")
+                after = connection.recv()
+                requests_by_endpoint = request_delta(before, after)
+                report = {
+                    "run": run,
+                    "artists": artists,
+                    "mode": args.mode,
+                    "wall_time": wall_time,
+                    "peak_memory": peak_memory,
+                    "requests": sum(requests_by_endpoint.values()),
+                    "not_modified": sum(
+                        stats["not_modified"] - before[name]["not_modified"]
+                        for name, stats in after.items()
+                    ),
+                    "sent_bytes": sum(
+                        stats["sent_bytes"] - before[name]["sent_bytes"]
+                        for name, stats in after.items()
+                    ),
+                    "requests_by_endpoint": requests_by_endpoint,
+                    "injected": {
+                        name: stats["injected"] for name, stats in after.items()
+                    },
+                }
+                reports.append(report)
+                print_report(report)
+    finally:
+        connection.send("stop")
+        server_process.join(timeout=5)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report_file:
+            json.dump(reports, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
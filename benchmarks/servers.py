@@ -0,0 +1,557 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from xml.sax.saxutils import escape
+
+ARTIST_PATTERN = re.compile(r"artist (\d+)", re.IGNORECASE)
+ALBUM_PATTERN = re.compile(r"album (\d+)\\?-(\d+)", re.IGNORECASE)
+TRACK_PATTERN = re.compile(r"track (\d+)-(\d+)-(\d+)", re.IGNORECASE)
+
+
+class StubRequest:
+    def __init__(self, method, path, query, body, host):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.host = host
+        self.match = None
+
+    def get(self, name, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def get_int(self, name, default=0):
+        return int(self.get(name, default))
+
+    def get_list(self, name):
+        return self.query.get(name, [])
+
+
+class StubResponse:
+    def __init__(self, payload, status=200, content_type="application/json"):
+        self.payload = payload
+        self.status = status
+        self.content_type = content_type
+        self.headers = {}
+
+    def encode(self):
+        if isinstance(self.payload, (bytes, str)):
+            body = self.payload
+        else:
+            body = json.dumps(self.payload)
+        return body.encode("utf-8") if isinstance(body, str) else body
+
+
+class StubApp:
+    """Routes of one fake backend, registered by subclasses with `route`."""
+
+    def __init__(self, library):
+        self.library = library
+        self.lock = threading.Lock()
+        self.routes = []
+
+    def route(self, methods, pattern, handler):
+        self.routes.append((set(methods.split("|")), re.compile(pattern), handler))
+
+    def resolve(self, request):
+        for methods, pattern, handler in self.routes:
+            match = pattern.fullmatch(request.path)
+            if match and request.method in methods:
+                request.match = match
+                return f"{request.method} {pattern.pattern}", handler
+        return f"{request.method} <unmatched>", None
+
+
+class StubServer:
+    """Threaded HTTP server for a StubApp with injected latency, errors and 429s.
+
+    Requests are counted per method and route pattern. With `etags`, GET
+    responses carry an ETag and are answered 304 when it still matches.
+    """
+
+    def __init__(
+        self,
+        app,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        rate_limit=None,
+        etags=False,
+        seed=0,
+    ):
+        self.app = app
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.etags = etags
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.injected = Counter()
+        self.not_modified = 0
+        self.sent_bytes = 0
+        self.tokens = rate_limit or 0
+        self.updated_at = time.monotonic()
+        self.httpd = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; avoid delayed-ACK stalls.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.handle(self)
+
+            do_POST = do_PUT = do_DELETE = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.counts),
+                "injected": dict(self.injected),
+                "not_modified": self.not_modified,
+                "sent_bytes": self.sent_bytes,
+            }
+
+    def _throttled(self):
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate_limit, self.tokens + (now - self.updated_at) * self.rate_limit
+            )
+            self.updated_at = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def _parse(self, handler):
+        url = urlparse(handler.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw_body = handler.rfile.read(length) if length else b""
+
+        body = None
+        content_type = handler.headers.get("Content-Type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            for name, values in parse_qs(
+                raw_body.decode("utf-8"), keep_blank_values=True
+            ).items():
+                query.setdefault(name, []).extend(values)
+        elif raw_body:
+            body = json.loads(raw_body)
+
+        return StubRequest(
+            handler.command, url.path, query, body, handler.headers.get("Host")
+        )
+
+    def handle(self, handler):
+        request = self._parse(handler)
+        endpoint, route_handler = self.app.resolve(request)
+        with self.lock:
+            self.counts[endpoint] += 1
+            fail = self.random.random() < self.error_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        if delay:
+            time.sleep(delay)
+
+        if self._throttled():
+            with self.lock:
+                self.injected["429"] += 1
+            response = StubResponse({"error": "rate limited"}, status=429)
+            response.headers["Retry-After"] = "1"
+        elif fail:
+            with self.lock:
+                self.injected["503"] += 1
+            response = StubResponse({"error": "injected failure"}, status=503)
+        elif route_handler is None:
+            response = StubResponse({"error": "not found"}, status=404)
+        else:
+            response = route_handler(request)
+            if not isinstance(response, StubResponse):
+                response = StubResponse(response)
+
+        self._send(handler, response)
+
+    def _send(self, handler, response):
+        body = response.encode()
+        if self.etags and handler.command == "GET" and response.status == 200:
+            etag = f'"{zlib.crc32(body):08x}"'
+            response.headers["ETag"] = etag
+            if handler.headers.get("If-None-Match") == etag:
+                response.status = 304
+                body = b""
+                with self.lock:
+                    self.not_modified += 1
+        with self.lock:
+            self.sent_bytes += len(body)
+
+        handler.send_response(response.status)
+        handler.send_header("Content-Type", response.content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in response.headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class SpotifyApp(StubApp):
+    def __init__(self, library):
+        super().__init__(library)
+        self.route("POST", r"/api/token", self.token)
+        self.route("GET", r"/v1/search", self.search)
+        self.route("GET", r"/v1/browse/categories", self.categories)
+        self.route(
+            "GET", r"/v1/browse/categories/([^/]+)/playlists", self.category_playlists
+        )
+        self.route("GET", r"/v1/playlists/pl(\d+)/tracks", self.tracks)
+
+    def token(self, request):
+        return {"access_token": "benchmark", "token_type": "Bearer", "expires_in": 3600}
+
+    def _playlists(self, playlist_indexes):
+        return {
+            "playlists": {
+                "items": [
+                    {"id": f"pl{p}", "name": f"Playlist {p}", "snapshot_id": f"s{p}"}
+                    for p in playlist_indexes
+                ]
+            }
+        }
+
+    def search(self, request):
+        match = ARTIST_PATTERN.fullmatch(request.get("q", ""))
+        if not match:
+            return self._playlists([])
+        return self._playlists(
+            self.library.artist_playlists(int(match[1]), request.get_int("limit", 20))
+        )
+
+    def categories(self, request):
+        offset = request.get_int("offset")
+        limit = request.get_int("limit", 20)
+        end = min(offset + limit, self.library.config.categories)
+        return {
+            "categories": {
+                "items": [
+                    {"id": f"cat{c}", "name": f"Category {c}"}
+                    for c in range(offset, end)
+                ]
+            }
+        }
+
+    def category_playlists(self, request):
+        category = zlib.crc32(request.match[1].encode())
+        return self._playlists(
+            self.library.category_playlists(category, request.get_int("limit", 20))
+        )
+
+    def tracks(self, request):
+        library = self.library
+        p = int(request.match[1])
+        offset = request.get_int("offset")
+        limit = request.get_int("limit", 100)
+        total = library.config.tracks_per_playlist
+
+        items = []
+        for k, a, t in list(library.playlist_tracks(p))[offset : offset + limit]:
+            items.append(
+                {
+                    "track": {
+                        "id": f"tr{k}-{a}-{t}",
+                        "name": library.track_title(k, a, t),
+                        "album": {
+                            "id": f"al{k}-{a}",
+                            "name": library.album_title(k, a),
+                        },
+                        "artists": [{"id": f"ar{k}", "name": library.artist_name(k)}],
+                    }
+                }
+            )
+
+        next_url = None
+        if offset + limit < total:
+            next_query = urlencode({"offset": offset + limit, "limit": limit})
+            next_url = f"http://{request.host}{request.path}?{next_query}"
+        return {"total": total, "next": next_url, "items": items}
+
+
+class LidarrApp(StubApp):
+    def __init__(self, library):
+        super().__init__(library)
+        self.next_album_id = (
+            library.config.artists * library.config.albums_per_artist + 1
+        )
+        self.route("GET", r"/api/v1/qualityprofile", self.quality_profiles)
+        self.route("GET", r"/api/v1/metadataprofile", self.metadata_profiles)
+        self.route("GET", r"/api/v1/rootfolder", self.root_folders)
+        self.route("GET", r"/api/v1/artist", self.artists)
+        self.route("GET", r"/api/v1/artist/lookup", self.artist_lookup)
+        self.route("GET", r"/api/v1/album", self.albums)
+        self.route("GET", r"/api/v1/album/lookup", self.album_lookup)
+        self.route("POST", r"/api/v1/album", self.add_album)
+        self.route("PUT", r"/api/v1/album/monitor", self.monitor_albums)
+        self.route("POST", r"/api/v1/command", self.command)
+
+    def quality_profiles(self, request):
+        return [{"id": 1, "name": "HQ"}]
+
+    def metadata_profiles(self, request):
+        return [{"id": 1, "name": "Standard"}]
+
+    def root_folders(self, request):
+        return [{"path": "/music"}]
+
+    def _artist(self, k):
+        library = self.library
+        return {
+            "id": k + 1 if library.artist_in_lidarr(k) else None,
+            "artistName": library.artist_name(k),
+            "disambiguation": "",
+            "monitored": library.artist_monitored(k),
+            "foreignArtistId": f"mb-artist-{k}",
+        }
+
+    def _album(self, k, a):
+        library = self.library
+        raw_album = {
+            "title": library.album_title(k, a),
+            "artistId": k + 1,
+            "monitored": library.album_monitored(k, a),
+            "foreignAlbumId": f"mb-album-{k}-{a}",
+        }
+        if library.album_in_lidarr(k, a):
+            raw_album["id"] = k * library.config.albums_per_artist + a + 1
+        return raw_album
+
+    def artists(self, request):
+        return [self._artist(k) for k in self.library.lidarr_artists()]
+
+    def artist_lookup(self, request):
+        match = ARTIST_PATTERN.fullmatch(request.get("term", ""))
+        return [self._artist(int(match[1]))] if match else []
+
+    def albums(self, request):
+        return [self._album(k, a) for k, a in self.library.lidarr_albums()]
+
+    def album_lookup(self, request):
+        match = ALBUM_PATTERN.search(request.get("term", ""))
+        if not match:
+            return []
+        k, a = int(match[1]), int(match[2])
+        return [{**self._album(k, a), "artist": self._artist(k)}]
+
+    def add_album(self, request):
+        with self.lock:
+            album_id = self.next_album_id
+            self.next_album_id += 1
+        return StubResponse({"id": album_id, **request.body}, status=201)
+
+    def monitor_albums(self, request):
+        return StubResponse([], status=202)
+
+    def command(self, request):
+        return StubResponse({"id": 1, "name": request.body["name"]}, status=201)
+
+
+class NavidromeApp(StubApp):
+    INDEXES_LAST_MODIFIED = 1_700_000_000_000
+
+    def __init__(self, library):
+        super().__init__(library)
+        self.playlists = {}
+        self.route("GET", r"/rest/getArtists", self.artists)
+        self.route("GET", r"/rest/getIndexes", self.indexes)
+        self.route("GET", r"/rest/search3", self.search)
+        self.route("GET", r"/rest/getPlaylists", self.get_playlists)
+        self.route("GET", r"/rest/getPlaylist", self.get_playlist)
+        self.route("GET|POST", r"/rest/createPlaylist", self.create_playlist)
+        self.route("GET|POST", r"/rest/updatePlaylist", self.update_playlist)
+
+    def _ok(self, **payload):
+        return {"subsonic-response": {"status": "ok", "version": "1.16.1", **payload}}
+
+    def _failed(self, code, message):
+        return {
+            "subsonic-response": {
+                "status": "failed",
+                "version": "1.16.1",
+                "error": {"code": code, "message": message},
+            }
+        }
+
+    def _song(self, k, a, t):
+        library = self.library
+        return {
+            "id": f"song{k}-{a}-{t}",
+            "title": library.track_title(k, a, t),
+            "artist": library.artist_name(k),
+            "artistId": f"ar{k}",
+            "album": library.album_title(k, a),
+            "albumId": f"al{k}-{a}",
+            "displayAlbumArtist": library.artist_name(k),
+        }
+
+    def artists(self, request):
+        album_counts = Counter(k for k, _ in self.library.navidrome_albums())
+        raw_artists = [
+            {
+                "id": f"ar{k}",
+                "name": self.library.artist_name(k),
+                "albumCount": album_counts[k],
+            }
+            for k in self.library.navidrome_artists()
+        ]
+        return self._ok(artists={"index": [{"name": "#", "artist": raw_artists}]})
+
+    def indexes(self, request):
+        # The library never changes, and index entries have no album count.
+        last_modified = self.INDEXES_LAST_MODIFIED
+        if request.get_int("ifModifiedSince", 0) >= last_modified:
+            return self._ok(indexes={"lastModified": last_modified})
+        raw_artists = [
+            {"id": f"ar{k}", "name": self.library.artist_name(k)}
+            for k in self.library.navidrome_artists()
+        ]
+        return self._ok(
+            indexes={
+                "lastModified": last_modified,
+                "index": [{"name": "#", "artist": raw_artists}],
+            }
+        )
+
+    def search(self, request):
+        library = self.library
+        query = request.get("query", "")
+        if query == "":
+            offset = request.get_int("songOffset")
+            end = min(
+                offset + request.get_int("songCount", 20),
+                library.navidrome_song_count(),
+            )
+            songs = [
+                self._song(*library.navidrome_song(index))
+                for index in range(offset, end)
+            ]
+            return self._ok(searchResult3={"song": songs})
+
+        match = TRACK_PATTERN.search(query)
+        songs = []
+        if match:
+            k, a, t = (int(group) for group in match.groups())
+            if library.album_in_navidrome(k, a):
+                songs.append(self._song(k, a, t))
+        return self._ok(searchResult3={"song": songs})
+
+    def get_playlists(self, request):
+        with self.lock:
+            raw_playlists = [
+                {"id": playlist_id, "name": playlist["name"]}
+                for playlist_id, playlist in self.playlists.items()
+            ]
+        return self._ok(playlists={"playlist": raw_playlists})
+
+    def get_playlist(self, request):
+        playlist_id = request.get("id")
+        with self.lock:
+            playlist = self.playlists.get(playlist_id)
+            if playlist is None:
+                return self._failed(70, "Playlist not found")
+            entries = [{"id": song_id} for song_id in playlist["songs"]]
+        return self._ok(
+            playlist={"id": playlist_id, "name": playlist["name"], "entry": entries}
+        )
+
+    def create_playlist(self, request):
+        with self.lock:
+            playlist_id = f"np{len(self.playlists) + 1}"
+            self.playlists[playlist_id] = {"name": request.get("name"), "songs": []}
+        return self._ok(playlist={"id": playlist_id, "name": request.get("name")})
+
+    def update_playlist(self, request):
+        with self.lock:
+            playlist = self.playlists.get(request.get("playlistId"))
+            if playlist is None:
+                return self._failed(70, "Playlist not found")
+
+            removed = {int(index) for index in request.get_list("songIndexToRemove")}
+            playlist["songs"] = [
+                song_id
+                for index, song_id in enumerate(playlist["songs"])
+                if index not in removed
+            ]
+            playlist["songs"].extend(request.get_list("songIdToAdd"))
+        return self._ok()
+
+
+class MusicBrainzApp(StubApp):
+    XML_HEADER = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#" '
+        'xmlns:ext="http://musicbrainz.org/ns/ext#-2.0">'
+    )
+
+    def __init__(self, library):
+        super().__init__(library)
+        self.route("GET", r"/ws/2/release-group/?", self.release_groups)
+        self.route("GET", r"/ws/2/artist/?", self.artists)
+
+    def _xml(self, body):
+        return StubResponse(
+            f"{self.XML_HEADER}{body}</metadata>", content_type="application/xml"
+        )
+
+    def release_groups(self, request):
+        match = ALBUM_PATTERN.search(request.get("query", ""))
+        if not match:
+            return self._xml('<release-group-list count="0" offset="0"/>')
+        k, a = int(match[1]), int(match[2])
+        title = escape(self.library.album_title(k, a))
+        return self._xml(
+            '<release-group-list count="1" offset="0">'
+            f'<release-group id="mb-album-{k}-{a}" type="Album" ext:score="100">'
+            f"<title>{title}</title></release-group></release-group-list>"
+        )
+
+    def artists(self, request):
+        match = ARTIST_PATTERN.search(request.get("query", ""))
+        if not match:
+            return self._xml('<artist-list count="0" offset="0"/>')
+        k = int(match[1])
+        name = escape(self.library.artist_name(k))
+        return self._xml(
+            '<artist-list count="1" offset="0">'
+            f'<artist id="mb-artist-{k}" type="Person" ext:score="100">'
+            f"<name>{name}</name></artist></artist-list>"
+        )
@@ -0,0 +1,100 @@
+import json
+import logging
+import os
+import threading
+import time
+from navidrome import NavidromeArtist
+from utils import write_json_atomically
+
+
+class ArtistScanStore:
+    """Persisted per-artist scan state for incremental artist processing.
+
+    Artists are keyed by Navidrome ID and fingerprinted by name and album
+    count. An artist is due when it is new or its fingerprint changed since
+    it was last processed; other artists are refreshed oldest first, at most
+    `refresh_budget` per run. The Navidrome index timestamp is kept so an
+    unchanged library is not listed again.
+    """
+
+    def __init__(self, path, refresh_budget=50):
+        self.path = path
+        self.refresh_budget = refresh_budget
+        self.lock = threading.Lock()
+        state = self._read()
+        self.last_modified = state.get("last_modified")
+        self.artists = state.get("artists", {})
+        logging.debug(f"Loaded scan state for {len(self.artists)} artists.")
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.path, encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable artist scan state {self.path}: {e}")
+            return {}
+
+    def _fingerprint(self, artist: NavidromeArtist):
+        return f"{artist.name}\t{artist.album_count}"
+
+    def select(self, artists: list[NavidromeArtist] | None, last_modified=None):
+        """Return the artists to process this run.
+
+        `artists` is the current Navidrome listing, or None when the library
+        is unchanged since `self.last_modified`.
+        """
+        with self.lock:
+            if artists is not None:
+                previous = self.artists
+                self.artists = {}
+                for artist in artists:
+                    state = previous.get(artist._id, {"processed_at": 0})
+                    state["name"] = artist.name
+                    state["fingerprint"] = self._fingerprint(artist)
+                    self.artists[artist._id] = state
+            if last_modified is not None:
+                self.last_modified = last_modified
+
+            due = []
+            unchanged = []
+            for artist_id, state in self.artists.items():
+                if state.get("processed_fingerprint") != state["fingerprint"]:
+                    due.append(artist_id)
+                else:
+                    unchanged.append(artist_id)
+            unchanged.sort(
+                key=lambda artist_id: self.artists[artist_id]["processed_at"]
+            )
+            refresh = unchanged[: self.refresh_budget]
+
+            logging.info(
+                f"Scanning {len(due)} new or changed and {len(refresh)} of "
+                f"{len(unchanged)} unchanged artists."
+            )
+            return [
+                NavidromeArtist(_id=artist_id, name=self.artists[artist_id]["name"])
+                for artist_id in due + refresh
+            ]
+
+    def mark_processed(self, artist: NavidromeArtist):
+        with self.lock:
+            state = self.artists.get(artist._id)
+            if state is not None:
+                state["processed_at"] = time.time()
+                state["processed_fingerprint"] = state["fingerprint"]
+
+    def save(self):
+        with self.lock:
+            state = {
+                "last_modified": self.last_modified,
+                "artists": {
+                    artist_id: dict(artist_state)
+                    for artist_id, artist_state in self.artists.items()
+                },
+            }
+
+        if write_json_atomically(self.path, state, "artist scan state"):
+            logging.debug(f"Saved scan state for {len(state['artists'])} artists.")
@@ -0,0 +1,49 @@
+import functools
+import inspect
+import threading
+
+
+class ConcurrencyLimitedService:
+    """Proxy that caps how many calls run concurrently against one backend.
+
+    Methods and properties of the wrapped service are executed while holding
+    a semaphore shared by every thread using the proxy. Calls the service
+    makes on itself bypass the proxy, so nested calls cannot deadlock.
+    Generators returned by the service hold the semaphore while producing
+    each item, not while the consumer works on it.
+    """
+
+    def __init__(self, service, limit):
+        self._service = service
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def __getattr__(self, name):
+        if isinstance(getattr(type(self._service), name, None), property):
+            with self._semaphore:
+                return getattr(self._service, name)
+
+        attribute = getattr(self._service, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def limited(*args, **kwargs):
+            with self._semaphore:
+                result = attribute(*args, **kwargs)
+            if inspect.isgenerator(result):
+                return self._limited_generator(result)
+            return result
+
+        return limited
+
+    def _limited_generator(self, generator):
+        try:
+            while True:
+                with self._semaphore:
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            generator.close()
@@ -0,0 +1,166 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+from requests.models import PreparedRequest
+from sqlite_store import SqliteStore
+
+
+@dataclass(frozen=True, slots=True)
+class CachedResponse:
+    """The parts of a requests.Response the service clients read."""
+
+    url: str
+    content: bytes
+    status_code: int = 200
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+
+@dataclass(frozen=True, slots=True)
+class HttpCacheEntry:
+    url: str
+    endpoint: str
+    content: bytes
+    etag: str | None
+    last_modified: str | None
+    expires_at: float
+
+    @property
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+    @property
+    def validators(self):
+        """Conditional request headers revalidating this entry."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def response(self):
+        return CachedResponse(url=self.url, content=self.content)
+
+
+class HttpCache(SqliteStore):
+    """SQLite store of GET responses, revalidated with ETag and Last-Modified.
+
+    Entries are served without a request until their endpoint's TTL runs
+    out, then revalidated with a conditional request whose 304 answer
+    renews them. Once the bodies exceed `max_bytes`, the least recently
+    used entries are evicted.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS http_cache ("
+        "url TEXT PRIMARY KEY, endpoint TEXT NOT NULL, content BLOB NOT NULL, "
+        "etag TEXT, last_modified TEXT, size INTEGER NOT NULL, "
+        "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS http_cache_accessed_at ON http_cache (accessed_at)",
+    )
+
+    def __init__(self, path, max_bytes=256 * 2**20, ttl=0, endpoint_ttls=None):
+        logging.debug(f"Opening HTTP cache at {path}")
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.endpoint_ttls = endpoint_ttls or {}
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM http_cache"
+        ).fetchone()[0]
+
+    @staticmethod
+    def cache_key(url, params=None):
+        """The URL with its query parameters, as requests would send it."""
+        request = PreparedRequest()
+        request.prepare_url(url, params)
+        return request.url
+
+    def ttl_for(self, endpoint):
+        return self.endpoint_ttls.get(endpoint, self.ttl)
+
+    def get(self, url):
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT endpoint, content, etag, last_modified, expires_at "
+                "FROM http_cache WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE http_cache SET accessed_at = ? WHERE url = ?",
+                (time.time(), url),
+            )
+
+        endpoint, content, etag, last_modified, expires_at = row
+        return HttpCacheEntry(url, endpoint, content, etag, last_modified, expires_at)
+
+    def store(self, url, endpoint, response):
+        """Cache a 200 response if it can be revalidated or has a TTL."""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        ttl = self.ttl_for(endpoint)
+        if "no-store" in response.headers.get("Cache-Control", ""):
+            return
+        if not etag and not last_modified and ttl <= 0:
+            return
+
+        content = response.content
+        if len(content) > self.max_bytes:
+            return
+
+        now = time.time()
+        with self.lock, self.connection:
+            previous = self.connection.execute(
+                "SELECT size FROM http_cache WHERE url = ?", (url,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    endpoint,
+                    content,
+                    etag,
+                    last_modified,
+                    len(content),
+                    now + ttl,
+                    now,
+                ),
+            )
+            self.size += len(content) - (previous[0] if previous else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def renew(self, entry, response):
+        """Extend an entry a 304 response confirmed, taking its new validators."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE http_cache SET etag = ?, last_modified = ?, expires_at = ? "
+                "WHERE url = ?",
+                (
+                    response.headers.get("ETag") or entry.etag,
+                    response.headers.get("Last-Modified") or entry.last_modified,
+                    time.time() + self.ttl_for(entry.endpoint),
+                    entry.url,
+                ),
+            )
+
+    def _evict(self):
+        evicted = 0
+        rows = self.connection.execute(
+            "SELECT url, size FROM http_cache ORDER BY accessed_at"
+        )
+        for url, size in rows.fetchall():
+            if self.size <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM http_cache WHERE url = ?", (url,))
+            self.size -= size
+            evicted += 1
+        logging.debug(f"Evicted {evicted} HTTP cache entries.")
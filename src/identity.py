@@ -0,0 +1,28 @@
+import threading
+
+
+class IdentityMap:
+    """Hands out one shared instance per model class and key.
+
+    Models are frozen, so every track of an artist can point at the same
+    artist object instead of a copy parsed from each track.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.instances = {}
+
+    def get(self, model, key, **fields):
+        """Return the instance interned under `key`, creating it from `fields`."""
+        instance = self.instances.get((model, key))
+        if instance is None:
+            with self.lock:
+                instance = self.instances.setdefault((model, key), model(**fields))
+        return instance
+
+    def clear(self):
+        with self.lock:
+            self.instances = {}
+
+    def __len__(self):
+        return len(self.instances)
@@ -1,22 +1,22 @@
 import requests
 import logging
-from dataclasses import dataclass
+import math
+import threading
+import time
+from dataclasses import dataclass, replace
+from matching import parse_title
 from musicbrainz import MusicBrainzService
+from transport import HttpTransport
+from utils import normalize_name
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LidarrArtist:
     name: str
     disambiguation: str
     is_monitored: bool
-
-    @property
-    def foreign_id(self):
-        mb = MusicBrainzService()
-        logging.debug(f"Fetching foreign ID for artist: {self.name}")
-        foreign_id = mb.get_artist_id(self.name)
-        logging.debug(f"Foreign ID for artist '{self.name}': {foreign_id}")
-        return foreign_id
+    _id: int | None = None
+    foreign_id: str | None = None
 
     def __str__(self):
         return (
@@ -25,21 +25,13 @@ class LidarrArtist:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LidarrAlbum:
     artist: LidarrArtist
     title: str
     is_monitored: bool
-
-    @property
-    def foreign_id(self):
-        mb = MusicBrainzService()
-        logging.debug(
-            f"Fetching foreign ID for album '{self.title}' by artist '{self.artist.name}'"
-        )
-        foreign_id = mb.get_album_id(self.title, self.artist.name)
-        logging.debug(f"Foreign ID for album '{self.title}': {foreign_id}")
-        return foreign_id
+    _id: int | None = None
+    foreign_id: str | None = None
 
     def __str__(self):
         return (
@@ -48,7 +40,7 @@ class LidarrAlbum:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LidarrQualityProfile:
     _id: int
     name: str
@@ -57,7 +49,7 @@ class LidarrQualityProfile:
         return f"LidarrQualityProfile(id={self._id}, name='{self.name}')"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LidarrMetadataProfile:
     _id: int
     name: str
@@ -67,18 +59,31 @@ class LidarrMetadataProfile:
 
 
 class LidarrService:
-    def __init__(self, lidarr_url, api_key):
+    BATCH_SIZE = 500
+    SEARCH_ATTEMPTS = 3
+
+    def __init__(self, lidarr_url, api_key, transport=None, musicbrainz=None):
         self.lidarr_url = lidarr_url
         self.api_key = api_key
+        self.transport = (transport or HttpTransport()).for_service("lidarr")
+        self.musicbrainz = musicbrainz or MusicBrainzService()
         self.headers = {"X-Api-Key": self.api_key}
         self.root_folder = self.get_root_folder_or_none()
+        self.artist_index = None
+        self.album_index = None
+        self.pending_lock = threading.Lock()
+        self.pending_adds = {}
+        self.pending_monitors = {}
+        # Foreign IDs looked up for artists and albums Lidarr did not know.
+        self.foreign_ids = {}
+        self.album_lookups = {}
 
     @property
     def quality_profiles(self):
         url = f"{self.lidarr_url}/api/v1/qualityprofile"
         try:
             logging.debug("Fetching quality profiles from Lidarr...")
-            response = requests.get(url, headers=self.headers)
+            response = self.transport.get(url, headers=self.headers)
             response.raise_for_status()
             raw_quality_profiles = response.json()
 
@@ -101,7 +106,7 @@ class LidarrService:
         url = f"{self.lidarr_url}/api/v1/metadataprofile"
         try:
             logging.debug("Fetching metadata profiles from Lidarr...")
-            response = requests.get(url, headers=self.headers)
+            response = self.transport.get(url, headers=self.headers)
             response.raise_for_status()
             raw_metadata_profiles = response.json()
 
@@ -153,7 +158,7 @@ class LidarrService:
     def get_root_folder_or_none(self):
         url = f"{self.lidarr_url}/api/v1/rootfolder"
         logging.debug("Fetching root folders from Lidarr...")
-        response = requests.get(url, headers=self.headers)
+        response = self.transport.get(url, headers=self.headers)
         if response.status_code == 200:
             root_folders = response.json()
             if len(root_folders) > 0:
@@ -163,91 +168,407 @@ class LidarrService:
         logging.warning("No root folder found or request failed.")
         return None
 
+    def load_artist_index(self):
+        url = f"{self.lidarr_url}/api/v1/artist"
+        self.foreign_ids = {}
+        self.album_lookups = {}
+        try:
+            logging.debug("Fetching artist library from Lidarr...")
+            response = self.transport.get(url, headers=self.headers)
+            response.raise_for_status()
+            raw_artists = response.json()
+        except requests.exceptions.RequestException as e:
+            logging.error(
+                f"Error fetching artist library, falling back to lookups: {e}"
+            )
+            self.artist_index = None
+            return
+
+        self.artist_index = {}
+        for raw_artist in raw_artists:
+            artist = self._load_artist_from_raw(raw_artist)
+            self.artist_index.setdefault(normalize_name(artist.name), artist)
+
+        logging.info(f"Indexed {len(self.artist_index)} artists from Lidarr.")
+
+    def _load_artist_from_raw(self, raw_artist):
+        return LidarrArtist(
+            name=raw_artist["artistName"],
+            disambiguation=raw_artist.get("disambiguation", ""),
+            is_monitored=raw_artist["monitored"],
+            _id=raw_artist.get("id"),
+            foreign_id=raw_artist.get("foreignArtistId"),
+        )
+
     def get_artist_or_none(self, artist_name):
-        url = f"{self.lidarr_url}/api/v1/artist/lookup?term={artist_name}"
-        logging.debug(f"Fetching artist '{artist_name}' from Lidarr...")
-        response = requests.get(url, headers=self.headers)
+        if self.artist_index is not None:
+            artist = self.artist_index.get(normalize_name(artist_name))
+            if artist:
+                logging.debug(f"Artist '{artist_name}' found in index: {artist}")
+                return artist
+
+        return self.lookup_artist_or_none(artist_name)
+
+    def lookup_artist_or_none(self, artist_name):
+        url = f"{self.lidarr_url}/api/v1/artist/lookup"
+        logging.debug(f"Looking up artist '{artist_name}' in Lidarr...")
+        response = self.transport.get(
+            url, params={"term": artist_name}, headers=self.headers
+        )
         if response.status_code == 200:
-            raw_artist = response.json()[0]
-            if raw_artist:
-                logging.debug(f"Artist found: {raw_artist}")
-                return LidarrArtist(
-                    name=raw_artist["artistName"],
-                    disambiguation=raw_artist["disambiguation"],
-                    is_monitored=raw_artist["monitored"],
-                )
+            raw_artists = response.json()
+            if raw_artists:
+                logging.debug(f"Artist found: {raw_artists[0]}")
+                return self._load_artist_from_raw(raw_artists[0])
         logging.warning(f"Artist '{artist_name}' not found.")
         return None
 
+    def load_album_index(self):
+        url = f"{self.lidarr_url}/api/v1/album"
+        try:
+            logging.debug("Fetching album library from Lidarr...")
+            response = self.transport.get(url, headers=self.headers)
+            response.raise_for_status()
+            raw_albums = response.json()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching album library, falling back to lookups: {e}")
+            self.album_index = None
+            return
+
+        artists_by_id = {
+            artist._id: artist for artist in (self.artist_index or {}).values()
+        }
+
+        self.album_index = {}
+        for raw_album in raw_albums:
+            artist = artists_by_id.get(raw_album.get("artistId"))
+            if artist is None and raw_album.get("artist"):
+                artist = self._load_artist_from_raw(raw_album["artist"])
+            if artist is None:
+                logging.debug(
+                    f"Skipping album without artist: {raw_album.get('title')}"
+                )
+                continue
+
+            album = LidarrAlbum(
+                artist=artist,
+                title=raw_album["title"],
+                is_monitored=raw_album["monitored"],
+                _id=raw_album["id"],
+                foreign_id=raw_album.get("foreignAlbumId"),
+            )
+            self.album_index.setdefault(self._album_key(album.title, artist), album)
+
+        logging.info(f"Indexed {len(self.album_index)} albums from Lidarr.")
+
+    def _album_key(self, album_title, artist):
+        return (normalize_name(artist.name), normalize_name(album_title))
+
     def get_album_or_none(self, album_title, artist):
-        url = f"{self.lidarr_url}/api/v1/album/lookup?term={album_title} {artist.name}"
+        if self.album_index is not None:
+            album = self.album_index.get(self._album_key(album_title, artist))
+            if album:
+                logging.debug(f"Album '{album_title}' found in index: {album}")
+            else:
+                logging.info(f"Album '{album_title}' by '{artist.name}' not in Lidarr.")
+            return album
+
+        return self.lookup_album_or_none(album_title, artist)
+
+    def lookup_album_or_none(self, album_title, artist):
+        url = f"{self.lidarr_url}/api/v1/album/lookup"
         logging.debug(
-            f"Fetching album '{album_title}' by artist '{artist.name}' from Lidarr..."
+            f"Looking up album '{album_title}' by artist '{artist.name}' in Lidarr..."
         )
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            raw_album = response.json()[0]
+        response = self.transport.get(
+            url, params={"term": f"{album_title} {artist.name}"}, headers=self.headers
+        )
+        raw_albums = response.json() if response.status_code == 200 else []
+        # Other albums or artists would be added or monitored in its place.
+        raw_album = next(
+            (
+                raw_album
+                for raw_album in raw_albums
+                if self._is_album_by(raw_album, artist)
+                and self._is_same_title(raw_album.get("title"), album_title)
+            ),
+            None,
+        )
+        if raw_album:
             logging.debug(f"Album found: {raw_album}")
             return LidarrAlbum(
                 artist=artist,
-                title=album_title,
+                title=raw_album.get("title") or album_title,
                 is_monitored=raw_album["monitored"],
+                _id=raw_album.get("id"),
+                foreign_id=raw_album.get("foreignAlbumId"),
             )
 
         logging.warning(f"Album '{album_title}' by '{artist.name}' not found.")
         return None
 
+    def get_artist_foreign_id(self, artist):
+        if artist.foreign_id:
+            return artist.foreign_id
+        if artist in self.foreign_ids:
+            return self.foreign_ids[artist]
+
+        logging.debug(f"Fetching foreign ID for artist from MusicBrainz: {artist.name}")
+        foreign_id = self.musicbrainz.get_artist_id(artist.name)
+        logging.debug(f"Foreign ID for artist '{artist.name}': {foreign_id}")
+        self.foreign_ids[artist] = foreign_id
+        return foreign_id
+
+    def _is_same_title(self, title, other_title):
+        """Whether two album titles match, ignoring suffixes like "(Remastered)"."""
+        return parse_title(title)[0] == parse_title(other_title)[0]
+
+    def _is_album_by(self, raw_album, artist):
+        raw_artist = raw_album.get("artist") or {}
+        if artist.foreign_id and raw_artist.get("foreignArtistId"):
+            return raw_artist["foreignArtistId"] == artist.foreign_id
+        if artist._id is not None and raw_album.get("artistId"):
+            return raw_album["artistId"] == artist._id
+        return normalize_name(raw_artist.get("artistName")) == normalize_name(
+            artist.name
+        )
+
+    def get_album_foreign_id(self, album):
+        if album.foreign_id:
+            return album.foreign_id
+        if album in self.foreign_ids:
+            return self.foreign_ids[album]
+
+        looked_up_album = self.lookup_queued_album_or_none(album)
+        if looked_up_album and looked_up_album.foreign_id:
+            foreign_id = looked_up_album.foreign_id
+        else:
+            logging.debug(
+                f"Fetching foreign ID for album '{album.title}' by artist '{album.artist.name}' "
+                "from MusicBrainz"
+            )
+            foreign_id = self.musicbrainz.get_album_id(album.title, album.artist.name)
+            logging.debug(f"Foreign ID for album '{album.title}': {foreign_id}")
+        self.foreign_ids[album] = foreign_id
+        return foreign_id
+
+    def lookup_queued_album_or_none(self, album):
+        """Album lookup of a queued addition, made once per run."""
+        if album not in self.album_lookups:
+            self.album_lookups[album] = self.lookup_album_or_none(
+                album.title, album.artist
+            )
+        return self.album_lookups[album]
+
     def add_album(self, album, quality_profile, metadata_profile):
+        """Queue an album to be added by `apply_album_writes`."""
+        key = self._album_key(album.title, album.artist)
+        logging.debug(f"Queueing album '{album.title}' to be added.")
+        with self.pending_lock:
+            self.pending_adds.setdefault(
+                key, (album, quality_profile, metadata_profile)
+            )
+        if self.album_index is not None:
+            self.album_index.setdefault(key, album)
+
+    def _post_album(self, album, quality_profile, metadata_profile):
+        """Add an album without searching for it and return its ID, or None."""
         add_url = f"{self.lidarr_url}/api/v1/album"
         payload = {
-            "foreignAlbumId": album.foreign_id,
+            "foreignAlbumId": self.get_album_foreign_id(album),
             "monitored": album.is_monitored,
             "artist": {
-                "foreignArtistId": album.artist.foreign_id,
+                "foreignArtistId": self.get_artist_foreign_id(album.artist),
                 "qualityProfileId": quality_profile._id,
                 "metadataProfileId": metadata_profile._id,
                 "rootFolderPath": self.root_folder,
             },
+            "addOptions": {"searchForNewAlbum": False},
         }
 
         logging.debug(f"Adding album with payload: {payload}")
-        response = requests.post(add_url, json=payload, headers=self.headers)
+        response = self.transport.post(add_url, json=payload, headers=self.headers)
         if response.status_code == 201:
             logging.info(
                 f"Album {album.title} by {album.artist.name} added successfully."
             )
-        else:
-            logging.error(f"Failed to add album: {response.content}")
+            album_id = response.json().get("id")
+            if self.album_index is not None:
+                self.album_index[self._album_key(album.title, album.artist)] = replace(
+                    album, _id=album_id
+                )
+            return album_id
+
+        logging.error(f"Failed to add album: {response.content}")
+        return None
 
     def monitor_album(self, album):
-        album_id = self.get_album_id(album)
+        """Queue an existing album to be monitored by `apply_album_writes`.
+
+        Returns the monitored copy of the album, or None without an album ID.
+        """
+        album_id = album._id if album._id is not None else self.get_album_id(album)
 
         if album_id is None:
-            logging.error(f"Could not find album ID for '{album.title}'. Aborting monitor call.")
-            return
+            logging.error(
+                f"Could not find album ID for '{album.title}'. Aborting monitor call."
+            )
+            return None
+
+        album = replace(album, _id=album_id, is_monitored=True)
+        logging.debug(f"Queueing album '{album.title}' to be monitored.")
+        with self.pending_lock:
+            self.pending_monitors.setdefault(album_id, album)
+        if self.album_index is not None:
+            self.album_index[self._album_key(album.title, album.artist)] = album
+        return album
 
+    def _put_monitored(self, album_ids):
         url = f"{self.lidarr_url}/api/v1/album/monitor"
-        payload = {
-            "albumIds": [album_id],
-            "monitored": True
+        payload = {"albumIds": album_ids, "monitored": True}
+
+        logging.debug(f"Monitoring albums with payload: {payload}")
+
+        response = self.transport.put(url, json=payload, headers=self.headers)
+        if response.status_code in (200, 202):
+            return True
+
+        logging.error(
+            f"Failed to update monitoring for albums {album_ids}: {response.content}"
+        )
+        return False
+
+    def take_pending_writes(self):
+        """Return and clear the queued (additions, monitors)."""
+        with self.pending_lock:
+            pending_adds = list(self.pending_adds.values())
+            pending_monitors = [
+                self.pending_monitors[album_id]
+                for album_id in sorted(self.pending_monitors)
+            ]
+            self.pending_adds = {}
+            self.pending_monitors = {}
+        return pending_adds, pending_monitors
+
+    def estimate_album_writes(self, pending_adds, pending_monitors):
+        """Upper bounds of the requests `apply_album_writes` sends.
+
+        Returns (lidarr, musicbrainz). Lidarr counts the album lookup of
+        each addition without a foreign ID, and either its POST or, when the
+        lookup finds it in the library, its share of a monitor batch, plus
+        one search (retries of a failed search come on top). MusicBrainz counts the fallbacks for foreign IDs the lookups do not
+        give, which its cache may answer instead.
+        """
+        unknown_albums = [
+            album
+            for album, _, _ in pending_adds
+            if not album.foreign_id and album not in self.album_lookups
+        ]
+        unknown_artists = {
+            album.artist
+            for album, _, _ in pending_adds
+            if not album.artist.foreign_id and album.artist not in self.foreign_ids
         }
+        monitor_batches = math.ceil(
+            (len(pending_monitors) + len(pending_adds)) / self.BATCH_SIZE
+        )
+        search = 1 if pending_adds or pending_monitors else 0
+        lidarr = len(unknown_albums) + len(pending_adds) + monitor_batches + search
+        return lidarr, len(unknown_albums) + len(unknown_artists)
+
+    def apply_album_writes(self, pending_adds, pending_monitors):
+        """Add and monitor albums, then search for all of them at once."""
+        if not pending_adds and not pending_monitors:
+            logging.debug("No pending Lidarr writes.")
+            return
 
-        logging.debug(f"Monitoring album '{album.title}' with payload: {payload}")
+        logging.info(
+            f"Applying {len(pending_adds)} album additions and {len(pending_monitors)} monitors."
+        )
 
-        response = requests.put(url, json=payload, headers=self.headers)
-        if response.status_code == 200:
-            logging.info(f"Album {album.title} is now being monitored.")
-        else:
-            logging.error(f"Failed to update monitoring for album {album.title}: {response.content}")
+        added_ids = []
+        added_foreign_ids = set()
+        pending_monitors = list(pending_monitors)
+        monitored_album_ids = {album._id for album in pending_monitors}
+        for album, quality_profile, metadata_profile in pending_adds:
+            # The index is keyed by exact title, so "Abbey Road (Remastered)"
+            # misses an album the lookup finds in the library.
+            library_album = self.lookup_queued_album_or_none(album)
+            if library_album and library_album._id is not None:
+                logging.debug(f"Album '{album.title}' is already in Lidarr.")
+                if (
+                    not library_album.is_monitored
+                    and library_album._id not in monitored_album_ids
+                ):
+                    monitored_album_ids.add(library_album._id)
+                    pending_monitors.append(library_album)
+                continue
+
+            foreign_id = self.get_album_foreign_id(album)
+            if foreign_id is None or foreign_id in added_foreign_ids:
+                logging.debug(f"Skipping duplicate or unknown album '{album.title}'.")
+                continue
+            added_foreign_ids.add(foreign_id)
+
+            album_id = self._post_album(album, quality_profile, metadata_profile)
+            if album_id is not None:
+                added_ids.append(album_id)
+
+        monitor_ids = [album._id for album in pending_monitors]
+        monitored_ids = []
+        for start in range(0, len(monitor_ids), self.BATCH_SIZE):
+            chunk = monitor_ids[start : start + self.BATCH_SIZE]
+            if self._put_monitored(chunk):
+                monitored_ids.extend(chunk)
+        logging.info(f"{len(monitored_ids)} albums are now being monitored.")
+
+        search_ids = sorted(set(added_ids + monitored_ids))
+        if search_ids:
+            self.search_albums(search_ids)
+
+    def search_albums(self, album_ids):
+        """Trigger one search for the albums, retrying as nothing else will.
+
+        Additions are posted without searching and are already monitored on
+        the next run, so a lost search is never queued again.
+        """
+        url = f"{self.lidarr_url}/api/v1/command"
+        payload = {"name": "AlbumSearch", "albumIds": album_ids}
+
+        for attempt in range(1, self.SEARCH_ATTEMPTS + 1):
+            logging.debug(f"Triggering album search for {len(album_ids)} albums.")
+            try:
+                response = self.transport.post(url, json=payload, headers=self.headers)
+                if response.status_code in (200, 201):
+                    logging.info(f"Triggered a search for {len(album_ids)} albums.")
+                    return True
+                error = response.content
+            except requests.exceptions.RequestException as e:
+                error = e
+
+            logging.warning(
+                f"Failed to trigger album search ({attempt}/{self.SEARCH_ATTEMPTS}): {error}"
+            )
+            if attempt < self.SEARCH_ATTEMPTS:
+                time.sleep(2**attempt)
+
+        logging.error(
+            f"Giving up on searching for albums {album_ids}; search for them in Lidarr."
+        )
+        return False
 
     def get_album_id(self, album):
-        url = f"{self.lidarr_url}/api/v1/album/lookup?term={album.title}"
+        url = f"{self.lidarr_url}/api/v1/album/lookup"
 
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
+        response = self.transport.get(
+            url, params={"term": album.title}, headers=self.headers
+        )
+        if response.status_code == 200 and response.json():
             raw_album = response.json()[0]
-            return raw_album.get('id')
+            return raw_album.get("id")
         else:
-            logging.error(f"Error fetching album ID for '{album.title}': {response.content}")
+            logging.error(
+                f"Error fetching album ID for '{album.title}': {response.content}"
+            )
 
-            return None
\ No newline at end of file
+            return None
@@ -1,13 +1,24 @@
+import argparse
+import os
+import sqlite3
 import time
 import logging
 from datetime import datetime
 from croniter import croniter
 
+from artist_scan import ArtistScanStore
+from concurrency import ConcurrencyLimitedService
+from http_cache import HttpCache
 from lidarr import LidarrService
-from musicbrainz import MusicBrainzService
+from metrics import start_metrics_server
+from musicbrainz import MusicBrainzCache, MusicBrainzService
 from navidrome import NavidromeService
 from spotify import SpotifyService
 from playlist import PlaylistManager
+from profiling import RunProfiler
+from sync_state import SyncStateStore
+from track_mapping import TrackMappingStore
+from transport import HttpTransport
 from utils import get_env_variable
 
 import logging
@@ -34,6 +45,16 @@ LIDARR_API_KEY = get_env_variable("LIDARR_API_KEY")
 NAVIDROME_URL = get_env_variable("NAVIDROME_URL", "http://localhost:4533")
 NAVIDROME_USERNAME = get_env_variable("NAVIDROME_USERNAME")
 NAVIDROME_PASSWORD = get_env_variable("NAVIDROME_PASSWORD")
+NAVIDROME_CATALOG_PATH = get_env_variable("NAVIDROME_CATALOG_PATH", "")
+NAVIDROME_CATALOG_MAX_AGE = int(get_env_variable("NAVIDROME_CATALOG_MAX_AGE", 3600))
+NAVIDROME_CATALOG_PAGE_SIZE = int(get_env_variable("NAVIDROME_CATALOG_PAGE_SIZE", 500))
+NAVIDROME_PLAYLIST_UPDATE_MODE = get_env_variable(
+    "NAVIDROME_PLAYLIST_UPDATE_MODE", "diff"
+).lower()
+NAVIDROME_PLAYLIST_CHUNK_SIZE = int(
+    get_env_variable("NAVIDROME_PLAYLIST_CHUNK_SIZE", 200)
+)
+NAVIDROME_MATCH_THRESHOLD = float(get_env_variable("NAVIDROME_MATCH_THRESHOLD", 0.8))
 
 # Playlist limits
 SPOTIFY_PLAYLIST_LIMIT_BY_ARTIST = int(
@@ -45,6 +66,11 @@ SPOTIFY_PLAYLIST_LIMIT_BY_CATEGORY = int(
 SPOTIFY_RANDOM_CATEGORY_LIMIT = int(
     get_env_variable("SPOTIFY_RANDOM_CATEGORY_LIMIT", 50)
 )
+SPOTIFY_MAX_CONCURRENCY = int(get_env_variable("SPOTIFY_MAX_CONCURRENCY", 4))
+SPOTIFY_RATE_LIMIT = float(get_env_variable("SPOTIFY_RATE_LIMIT", 10))
+SPOTIFY_RATE_BURST = int(get_env_variable("SPOTIFY_RATE_BURST", 20))
+SPOTIFY_MAX_RETRIES = int(get_env_variable("SPOTIFY_MAX_RETRIES", 5))
+SPOTIFY_PLAYLIST_PREFETCH = int(get_env_variable("SPOTIFY_PLAYLIST_PREFETCH", 4))
 
 # Included and excluded categories
 INCLUDED_CATEGORIES = get_env_variable("INCLUDED_CATEGORIES", "").split(",")
@@ -54,10 +80,115 @@ EXCLUDED_CATEGORIES = get_env_variable("EXCLUDED_CATEGORIES", "").split(",")
 QUALITY_PROFILE_NAME = get_env_variable("QUALITY_PROFILE_NAME", "HQ")
 METADATA_PROFILE_NAME = get_env_variable("METADATA_PROFILE_NAME", "Standard")
 
+# Persistent state (caches, sync state) lives under this directory
+DATA_DIR = get_env_variable("DATA_DIR", "/data")
+
+# MusicBrainz ID cache
+MUSICBRAINZ_CACHE_TTL = int(get_env_variable("MUSICBRAINZ_CACHE_TTL", 30 * 24 * 3600))
+MUSICBRAINZ_NEGATIVE_CACHE_TTL = int(
+    get_env_variable("MUSICBRAINZ_NEGATIVE_CACHE_TTL", 24 * 3600)
+)
+
+# Skip Spotify playlists whose snapshot_id did not change since the last sync
+INCREMENTAL_SYNC = get_env_variable("INCREMENTAL_SYNC", "true").lower() == "true"
+SYNC_STATE_MAX_AGE = int(get_env_variable("SYNC_STATE_MAX_AGE", 7 * 24 * 3600))
+
+# Only scan new or changed Navidrome artists, plus a rotating share of the others
+INCREMENTAL_ARTIST_SCAN = (
+    get_env_variable("INCREMENTAL_ARTIST_SCAN", "false").lower() == "true"
+)
+ARTIST_REFRESH_BUDGET = int(get_env_variable("ARTIST_REFRESH_BUDGET", 50))
+
+# Conditional-request cache of Spotify responses (stored in DATA_DIR/http-cache.sqlite)
+SPOTIFY_HTTP_CACHE = get_env_variable("SPOTIFY_HTTP_CACHE", "false").lower() == "true"
+SPOTIFY_HTTP_CACHE_MAX_MB = int(get_env_variable("SPOTIFY_HTTP_CACHE_MAX_MB", 256))
+SPOTIFY_HTTP_CACHE_TTL = int(get_env_variable("SPOTIFY_HTTP_CACHE_TTL", 0))
+SPOTIFY_HTTP_CACHE_TTLS = {
+    endpoint.strip(): int(ttl)
+    for endpoint, _, ttl in (
+        item.partition("=")
+        for item in get_env_variable("SPOTIFY_HTTP_CACHE_TTLS", "").split(",")
+        if item.strip()
+    )
+}
+
+# Spotify to Navidrome track mappings (stored in DATA_DIR/track-mappings.sqlite)
+TRACK_MAPPING_RETRY_AFTER = int(
+    get_env_variable("TRACK_MAPPING_RETRY_AFTER", 12 * 3600)
+)
+
+# Execution engine: sequential, async (pipelined stages) or threaded (worker pools)
+PROCESS_MODE = get_env_variable("PROCESS_MODE", "sequential").lower()
+PIPELINE_WORKERS = int(get_env_variable("PIPELINE_WORKERS", 4))
+LIDARR_MAX_CONCURRENCY = int(get_env_variable("LIDARR_MAX_CONCURRENCY", 4))
+NAVIDROME_MAX_CONCURRENCY = int(get_env_variable("NAVIDROME_MAX_CONCURRENCY", 4))
+MUSICBRAINZ_MAX_CONCURRENCY = int(get_env_variable("MUSICBRAINZ_MAX_CONCURRENCY", 1))
+
+# HTTP transport shared by all services
+HTTP_POOL_CONNECTIONS = int(get_env_variable("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(get_env_variable("HTTP_POOL_MAXSIZE", 10))
+HTTP_CONNECT_TIMEOUT = float(get_env_variable("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(get_env_variable("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_RETRIES = int(get_env_variable("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(get_env_variable("HTTP_BACKOFF_FACTOR", 0.5))
+
+# Per-run profiling reports (JSON, plus an optional cProfile dump)
+PROFILING = get_env_variable("PROFILING", "false").lower() == "true"
+PROFILING_DIR = get_env_variable("PROFILING_DIR", "")
+PROFILING_CPROFILE = get_env_variable("PROFILING_CPROFILE", "false").lower() == "true"
+PROFILING_TOP_ALLOCATORS = int(get_env_variable("PROFILING_TOP_ALLOCATORS", 20))
+
+# Port serving Prometheus metrics at /metrics, disabled when empty
+METRICS_PORT = get_env_variable("METRICS_PORT", "")
+
 # Cron-like schedule for running the task
 CRON_SCHEDULE = get_env_variable("CRON_SCHEDULE", "0 0 * * *")
 
 
+def get_musicbrainz_cache():
+    try:
+        return MusicBrainzCache(
+            os.path.join(DATA_DIR, "musicbrainz.sqlite"),
+            ttl=MUSICBRAINZ_CACHE_TTL,
+            negative_ttl=MUSICBRAINZ_NEGATIVE_CACHE_TTL,
+        )
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(
+            f"MusicBrainz cache disabled, cannot open it in {DATA_DIR}: {e}"
+        )
+        return None
+
+
+def get_track_mapping_store():
+    try:
+        return TrackMappingStore(
+            os.path.join(DATA_DIR, "track-mappings.sqlite"),
+            retry_after=TRACK_MAPPING_RETRY_AFTER,
+        )
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(
+            f"Track mapping store disabled, cannot open it in {DATA_DIR}: {e}"
+        )
+        return None
+
+
+def get_spotify_http_cache():
+    if not SPOTIFY_HTTP_CACHE:
+        return None
+    try:
+        return HttpCache(
+            os.path.join(DATA_DIR, "http-cache.sqlite"),
+            max_bytes=SPOTIFY_HTTP_CACHE_MAX_MB * 2**20,
+            ttl=SPOTIFY_HTTP_CACHE_TTL,
+            endpoint_ttls=SPOTIFY_HTTP_CACHE_TTLS,
+        )
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(
+            f"Spotify HTTP cache disabled, cannot open it in {DATA_DIR}: {e}"
+        )
+        return None
+
+
 def get_playlist_manager():
     """Run the main playlist processing logic."""
     logging.info(f"Running task at {datetime.now()}")
@@ -73,21 +204,62 @@ def get_playlist_manager():
     logging.debug(f"Lidarr Metadata Profile: {METADATA_PROFILE_NAME}")
 
     # Initialize services
+    logging.debug("Initializing HTTP transport...")
+    transport = HttpTransport(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        max_retries=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+    )
+
     logging.debug("Initializing Spotify service...")
     spotify = SpotifyService(
-        client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET
+        client_id=SPOTIFY_CLIENT_ID,
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        transport=transport,
+        max_concurrency=SPOTIFY_MAX_CONCURRENCY,
+        rate_limit=SPOTIFY_RATE_LIMIT,
+        rate_burst=SPOTIFY_RATE_BURST,
+        max_retries=SPOTIFY_MAX_RETRIES,
+        playlist_prefetch=SPOTIFY_PLAYLIST_PREFETCH,
+        cache=get_spotify_http_cache(),
     )
 
+    logging.debug("Initializing MusicBrainz service...")
+    musicbrainz = MusicBrainzService(cache=get_musicbrainz_cache())
+
     logging.debug("Initializing Lidarr service...")
-    lidarr = LidarrService(lidarr_url=LIDARR_URL, api_key=LIDARR_API_KEY)
+    lidarr = LidarrService(
+        lidarr_url=LIDARR_URL,
+        api_key=LIDARR_API_KEY,
+        transport=transport,
+        musicbrainz=musicbrainz,
+    )
 
     logging.debug("Initializing Navidrome service...")
     navidrome = NavidromeService(
         navidrome_url=NAVIDROME_URL,
         username=NAVIDROME_USERNAME,
         password=NAVIDROME_PASSWORD,
+        transport=transport,
+        catalog_path=NAVIDROME_CATALOG_PATH or None,
+        catalog_max_age=NAVIDROME_CATALOG_MAX_AGE,
+        catalog_page_size=NAVIDROME_CATALOG_PAGE_SIZE,
+        playlist_update_mode=NAVIDROME_PLAYLIST_UPDATE_MODE,
+        playlist_chunk_size=NAVIDROME_PLAYLIST_CHUNK_SIZE,
+        match_threshold=NAVIDROME_MATCH_THRESHOLD,
     )
 
+    if PROCESS_MODE != "sequential":
+        logging.debug(f"Limiting backend concurrency for {PROCESS_MODE} mode...")
+        lidarr.musicbrainz = ConcurrencyLimitedService(
+            musicbrainz, MUSICBRAINZ_MAX_CONCURRENCY
+        )
+        lidarr = ConcurrencyLimitedService(lidarr, LIDARR_MAX_CONCURRENCY)
+        navidrome = ConcurrencyLimitedService(navidrome, NAVIDROME_MAX_CONCURRENCY)
+
     # Initialize playlist manager
     logging.debug("Initializing Playlist Manager...")
     playlist_manager = PlaylistManager(
@@ -101,6 +273,33 @@ def get_playlist_manager():
         random_category_limit=SPOTIFY_RANDOM_CATEGORY_LIMIT,
         quality_profile_name=QUALITY_PROFILE_NAME,
         metadata_profile_name=METADATA_PROFILE_NAME,
+        sync_state=(
+            SyncStateStore(
+                os.path.join(DATA_DIR, "sync-state.json"), max_age=SYNC_STATE_MAX_AGE
+            )
+            if INCREMENTAL_SYNC
+            else None
+        ),
+        track_mappings=get_track_mapping_store(),
+        artist_scan=(
+            ArtistScanStore(
+                os.path.join(DATA_DIR, "artist-scan.json"),
+                refresh_budget=ARTIST_REFRESH_BUDGET,
+            )
+            if INCREMENTAL_ARTIST_SCAN
+            else None
+        ),
+        mode=PROCESS_MODE,
+        workers=PIPELINE_WORKERS,
+        profiler=(
+            RunProfiler(
+                PROFILING_DIR or os.path.join(DATA_DIR, "profiles"),
+                cprofile=PROFILING_CPROFILE,
+                top_allocators=PROFILING_TOP_ALLOCATORS,
+            )
+            if PROFILING
+            else None
+        ),
     )
 
     return playlist_manager
@@ -112,6 +311,9 @@ def schedule_task():
     logging.debug(f"Initial cron schedule: {CRON_SCHEDULE}")
     logging.debug(f"Next scheduled run time: {cron.get_next(datetime)}")
 
+    if METRICS_PORT:
+        start_metrics_server(int(METRICS_PORT))
+
     playlist_manager = get_playlist_manager()
 
     logging.debug("Starting playlist processing...")
@@ -135,7 +337,40 @@ def schedule_task():
         time.sleep(60)
 
 
+def dry_run(plan_output=None):
+    logging.info("Planning a single run without writing to Lidarr or Navidrome.")
+    plan = get_playlist_manager().process(dry_run=True)
+
+    if plan_output:
+        with open(plan_output, "w", encoding="utf-8") as plan_file:
+            plan_file.write(plan.to_json())
+        logging.info(f"Plan written to {plan_output}")
+    else:
+        print(plan.to_json())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Sync Spotify playlists to Lidarr and Navidrome."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="plan a single run, print it as JSON with estimated request counts and exit",
+    )
+    parser.add_argument(
+        "--plan-output",
+        help="write the dry-run plan to this file instead of stdout",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    if args.dry_run:
+        dry_run(args.plan_output)
+        return
+
     logging.info(f"Scheduling task with cron: {CRON_SCHEDULE}")
     schedule_task()
 
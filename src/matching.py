@@ -0,0 +1,274 @@
+import functools
+import logging
+import math
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from utils import normalize_name
+
+# Trailing "(...)", "[...]" or " - ..." suffixes, stripped when they name a version.
+BRACKETED_SUFFIX = re.compile(r"\s*(?:\(([^()]*)\)|\[([^\[\]]*)\])\s*$")
+DASHED_SUFFIX = re.compile(r"\s+-\s+([^-]+)$")
+FEATURING = re.compile(r"\s+[(\[]?(?:feat|ft|featuring)\b.*$", re.IGNORECASE)
+VERSION_WORDS = re.compile(
+    r"\b(?:remaster(?:ed)?|live|mono|stereo|edit|version|mix|remix|explicit|clean|"
+    r"deluxe|bonus|anniversary|edition|acoustic|demo|instrumental|session|"
+    r"recording|take|feat|ft|featuring|with)\b",
+    re.IGNORECASE,
+)
+# Versions that are a different recording, not just a different release.
+RECORDING_TAGS = re.compile(
+    r"\b(live|acoustic|demo|instrumental|remix)\b", re.IGNORECASE
+)
+NUMBERS = re.compile(r"\d+")
+
+
+def strip_title(title):
+    """Return a track title without version suffixes, and its recording tags.
+
+    Featured artists and suffixes such as "- Remastered 2011" or "(Live)"
+    are dropped; live, acoustic, demo, instrumental and remix versions are
+    kept apart through their tags.
+    """
+    title = title or ""
+    tags = set()
+    while True:
+        match = BRACKETED_SUFFIX.search(title) or DASHED_SUFFIX.search(title)
+        if not match or not title[: match.start()].strip():
+            break
+        suffix = next(group for group in match.groups() if group is not None)
+        if not VERSION_WORDS.search(suffix):
+            break
+        tags.update(tag.lower() for tag in RECORDING_TAGS.findall(suffix))
+        title = title[: match.start()]
+
+    return FEATURING.sub("", title).strip() or title.strip(), frozenset(tags)
+
+
+def parse_title(title):
+    """Return (key, recording tags) of a track title."""
+    stripped, tags = strip_title(title)
+    return normalize_name(stripped) or normalize_name(title), tags
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_artist(name):
+    key = normalize_name(FEATURING.sub("", name or ""))
+    return key[4:] if key.startswith("the ") else key
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return frozenset(sys.intern(padded[i : i + 3]) for i in range(len(padded) - 2))
+
+
+def dice(grams, other_grams):
+    if not grams or not other_grams:
+        return 0.0
+    return 2 * len(grams & other_grams) / (len(grams) + len(other_grams))
+
+
+class TrackMatcher:
+    """Fuzzy index of catalog tracks for (artist, title, album) lookups.
+
+    Tracks are blocked by normalized artist and then by title key, so most
+    lookups are two dict hits. Otherwise the title is scored by trigram
+    Dice similarity against the artist's tracks, whose trigram sets are
+    computed the first time the artist misses. Titles must share their
+    numbers ("Part 1" is not "Part 2") and recording tags cost a penalty
+    when they differ. Artists missing from the index are matched the same
+    way against the artist names.
+    """
+
+    # Bumped when matching changes, so stored track mappings are redone.
+    VERSION = 1
+    TAG_PENALTY = 0.25
+    PARALLEL_THRESHOLD = 20_000
+    CHUNK_SIZE = 5_000
+
+    def __init__(self, threshold=0.8, artist_threshold=0.85):
+        self.threshold = threshold
+        self.artist_threshold = artist_threshold
+        # artist key -> title key -> [(track, tags, album key)]
+        self.blocks = {}
+        self.block_grams = {}
+        self.artist_grams = None
+        self.artist_matches = {}
+        self.size = 0
+
+    def add(self, track, artist_names, album_title=None):
+        title_key, tags = parse_title(track.title)
+        entry = (track, tags, normalize_name(album_title))
+        for artist_key in {normalize_artist(name) for name in artist_names if name}:
+            self.blocks.setdefault(artist_key, {}).setdefault(title_key, []).append(
+                entry
+            )
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def match(self, artist_name, title, album_title=None):
+        """Return the best matching track, or None below the threshold."""
+        location = self.locate(artist_name, title, album_title)
+        return self._track_at(location) if location else None
+
+    def locate(self, artist_name, title, album_title=None):
+        """Return (artist key, title key, position) of the best match, or None."""
+        title_key, tags = parse_title(title)
+        album_key = normalize_name(album_title)
+        best = None
+        for artist_key in self._artist_keys(artist_name):
+            for candidate in self._candidates(artist_key, title_key, tags, album_key):
+                if best is None or candidate[0] > best[0]:
+                    best = candidate
+        if best is None or best[0][0] < self.threshold:
+            return None
+        return best[1]
+
+    def match_many(self, queries, processes=None):
+        """Match (artist, title, album) queries, on a process pool for large batches."""
+        queries = list(queries)
+        processes = processes or os.cpu_count() or 1
+        if len(queries) < self.PARALLEL_THRESHOLD or processes == 1:
+            locations = [self.locate(*query) for query in queries]
+        else:
+            chunks = [
+                queries[start : start + self.CHUNK_SIZE]
+                for start in range(0, len(queries), self.CHUNK_SIZE)
+            ]
+            logging.debug(
+                f"Matching {len(queries)} tracks in {len(chunks)} chunks on a process pool."
+            )
+            # Spawned workers, as forking a process running threads is unsafe.
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self._without_tracks(),),
+            ) as executor:
+                locations = [
+                    location
+                    for chunk_locations in executor.map(_locate_chunk, chunks)
+                    for location in chunk_locations
+                ]
+        return [
+            self._track_at(location) if location else None for location in locations
+        ]
+
+    def _without_tracks(self):
+        """Copy of the index for workers, which only return locations."""
+        matcher = TrackMatcher(self.threshold, self.artist_threshold)
+        matcher.blocks = {
+            artist_key: {
+                title_key: [(None, tags, album_key) for _, tags, album_key in entries]
+                for title_key, entries in block.items()
+            }
+            for artist_key, block in self.blocks.items()
+        }
+        matcher.size = self.size
+        return matcher
+
+    def _track_at(self, location):
+        artist_key, title_key, position = location
+        return self.blocks[artist_key][title_key][position][0]
+
+    def _artist_keys(self, artist_name):
+        artist_key = normalize_artist(artist_name)
+        if artist_key in self.blocks:
+            return (artist_key,)
+
+        matches = self.artist_matches.get(artist_key)
+        if matches is None:
+            matches = self._similar_artists(artist_key)
+            self.artist_matches[artist_key] = matches
+        return matches
+
+    def _similar_artists(self, artist_key):
+        if self.artist_grams is None:
+            self._index_artists()
+        artist_grams, artist_postings = self.artist_grams
+        grams = trigrams(artist_key)
+
+        # Any artist above the threshold shares at least min_overlap trigrams,
+        # so it holds one of the len(grams) - min_overlap + 1 rarest ones.
+        threshold = self.artist_threshold
+        min_length = math.ceil(len(grams) * threshold / (2 - threshold) - 1e-9)
+        min_overlap = math.ceil(threshold * (len(grams) + min_length) / 2 - 1e-9)
+        rarest = sorted(grams, key=lambda gram: len(artist_postings.get(gram, ())))
+        candidates = {
+            other_key
+            for gram in rarest[: len(grams) - min_overlap + 1]
+            for other_key in artist_postings.get(gram, ())
+        }
+        return tuple(
+            other_key
+            for other_key in candidates
+            if dice(grams, artist_grams[other_key]) >= threshold
+        )
+
+    def _index_artists(self):
+        artist_grams = {artist_key: trigrams(artist_key) for artist_key in self.blocks}
+        artist_postings = {}
+        for artist_key, grams in artist_grams.items():
+            for gram in grams:
+                artist_postings.setdefault(gram, []).append(artist_key)
+        self.artist_grams = artist_grams, artist_postings
+
+    def _candidates(self, artist_key, title_key, tags, album_key):
+        """Yield ((score, same album), location) of plausible tracks."""
+        block = self.blocks[artist_key]
+        exact = block.get(title_key)
+        if exact:
+            for position, entry in enumerate(exact):
+                yield self._rank(1.0, tags, album_key, entry), (
+                    artist_key,
+                    title_key,
+                    position,
+                )
+            return
+
+        grams = trigrams(title_key)
+        numbers = NUMBERS.findall(title_key)
+        for other_key, other_grams, other_numbers in self._block_grams(artist_key):
+            if other_numbers != numbers:
+                continue
+            similarity = dice(grams, other_grams)
+            if similarity < self.threshold:
+                continue
+            for position, entry in enumerate(block[other_key]):
+                yield self._rank(similarity, tags, album_key, entry), (
+                    artist_key,
+                    other_key,
+                    position,
+                )
+
+    def _block_grams(self, artist_key):
+        block_grams = self.block_grams.get(artist_key)
+        if block_grams is None:
+            block_grams = [
+                (title_key, trigrams(title_key), NUMBERS.findall(title_key))
+                for title_key in self.blocks[artist_key]
+            ]
+            self.block_grams[artist_key] = block_grams
+        return block_grams
+
+    def _rank(self, similarity, tags, album_key, entry):
+        _, entry_tags, entry_album_key = entry
+        score = similarity - self.TAG_PENALTY * len(tags ^ entry_tags)
+        # The album only breaks ties, e.g. between a single and its album.
+        return score, bool(album_key) and album_key == entry_album_key
+
+
+_worker_matcher = None
+
+
+def _init_worker(matcher):
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _locate_chunk(queries):
+    return [_worker_matcher.locate(*query) for query in queries]
@@ -0,0 +1,38 @@
+import threading
+from concurrent.futures import Future
+
+
+class RunMemo:
+    """Memo of values resolved during one run.
+
+    Concurrent callers asking for the same key while it is being computed
+    wait for that single computation instead of starting their own.
+    Failed computations are forgotten so a later caller can retry.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def clear(self):
+        with self.lock:
+            self.futures = {}
+
+    def get_or_compute(self, namespace, key, compute):
+        with self.lock:
+            future = self.futures.get((namespace, key))
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.futures[(namespace, key)] = future
+
+        if is_owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                with self.lock:
+                    self.futures.pop((namespace, key), None)
+                future.set_exception(e)
+                raise
+
+        return future.result()
@@ -0,0 +1,70 @@
+import logging
+from prometheus_client import Counter, Histogram, start_http_server
+
+HTTP_REQUESTS = Counter(
+    "playlistarr_http_requests",
+    "Outbound requests by service, endpoint template, method and status class.",
+    ["service", "endpoint", "method", "status_class"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "playlistarr_http_request_duration_seconds",
+    "Outbound request latency, including transport-level retries.",
+    ["service", "endpoint", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_RESPONSE_BYTES = Counter(
+    "playlistarr_http_response_bytes",
+    "Response body bytes received.",
+    ["service", "endpoint"],
+)
+HTTP_RETRIES = Counter(
+    "playlistarr_http_retries",
+    "Requests retried by the transport or the service client.",
+    ["service", "endpoint"],
+)
+HTTP_CACHE = Counter(
+    "playlistarr_http_cache",
+    "HTTP cache lookups by result: fresh, revalidated or miss.",
+    ["service", "endpoint", "result"],
+)
+PHASE_RUNS = Counter(
+    "playlistarr_phase_runs",
+    "Completed PlaylistManager.process phases.",
+    ["phase"],
+)
+PHASE_SECONDS = Counter(
+    "playlistarr_phase_seconds",
+    "Wall time spent in PlaylistManager.process phases.",
+    ["phase"],
+)
+PLAN_ACTIONS = Counter(
+    "playlistarr_plan_actions",
+    "Actions planned by PlaylistManager.process.",
+    ["action"],
+)
+
+
+def status_class(status_code):
+    return f"{status_code // 100}xx"
+
+
+def observe_request(
+    service, endpoint, method, status, duration, response_bytes=0, retries=0
+):
+    """Record one outbound call; `status` is a status class such as "2xx"."""
+    HTTP_REQUESTS.labels(service, endpoint, method, status).inc()
+    HTTP_REQUEST_DURATION.labels(service, endpoint, method).observe(duration)
+    if response_bytes:
+        HTTP_RESPONSE_BYTES.labels(service, endpoint).inc(response_bytes)
+    if retries:
+        HTTP_RETRIES.labels(service, endpoint).inc(retries)
+
+
+def observe_phase(phase, duration):
+    PHASE_RUNS.labels(phase).inc()
+    PHASE_SECONDS.labels(phase).inc(duration)
+
+
+def start_metrics_server(port):
+    logging.info(f"Serving Prometheus metrics on port {port} at /metrics")
+    start_http_server(port)
@@ -1,61 +1,143 @@
 import musicbrainzngs
 import logging
+import time
+from metrics import observe_request
+from sqlite_store import SqliteStore
+from utils import normalize_name
+
+
+class MusicBrainzCache(SqliteStore):
+    """SQLite store of MusicBrainz IDs, including "not found" results."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS musicbrainz_ids ("
+        "kind TEXT NOT NULL, key TEXT NOT NULL, mbid TEXT, "
+        "expires_at REAL NOT NULL, PRIMARY KEY (kind, key))",
+    )
+
+    def __init__(self, path, ttl=30 * 24 * 3600, negative_ttl=24 * 3600):
+        logging.debug(f"Opening MusicBrainz cache at {path}")
+        super().__init__(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def get(self, kind, key):
+        """Return (found, mbid); mbid is None for a cached "not found"."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mbid, expires_at FROM musicbrainz_ids WHERE kind = ? AND key = ?",
+                (kind, key),
+            ).fetchone()
+
+        if row is None or row[1] < time.time():
+            return False, None
+        return True, row[0]
+
+    def set(self, kind, key, mbid):
+        ttl = self.ttl if mbid else self.negative_ttl
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO musicbrainz_ids (kind, key, mbid, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (kind, key, mbid, time.time() + ttl),
+            )
 
 
 class MusicBrainzService:
-    def __init__(self):
+    ENDPOINTS = {"album": "/ws/2/release-group", "artist": "/ws/2/artist"}
+
+    def __init__(self, cache=None):
         logging.debug("Initializing MusicBrainzService...")
         musicbrainzngs.set_useragent(
             "playlistarr", "1.0", "https://github.com/eralumin/playlistarr"
         )
         logging.debug("MusicBrainz user agent set successfully.")
+        self.cache = cache
+        self.memo = {}
+
+    def clear_memo(self):
+        self.memo = {}
+
+    def _get_cached_or_search(self, kind, key, search):
+        if (kind, key) in self.memo:
+            return self.memo[(kind, key)]
+
+        found, mbid = self.cache.get(kind, key) if self.cache else (False, None)
+        if found:
+            logging.debug(
+                f"MusicBrainz {kind} ID for '{key}' served from cache: {mbid}"
+            )
+        else:
+            started_at = time.perf_counter()
+            try:
+                mbid = search()
+            except Exception as e:
+                observe_request(
+                    "musicbrainz",
+                    self.ENDPOINTS[kind],
+                    "GET",
+                    "error",
+                    time.perf_counter() - started_at,
+                )
+                logging.error(f"Error fetching MusicBrainz {kind} ID for '{key}': {e}")
+                return None
+            observe_request(
+                "musicbrainz",
+                self.ENDPOINTS[kind],
+                "GET",
+                "2xx",
+                time.perf_counter() - started_at,
+            )
+
+            if self.cache:
+                self.cache.set(kind, key, mbid)
+
+        self.memo[(kind, key)] = mbid
+        return mbid
 
     def get_album_id(self, album_title: str, artist_name: str) -> str | None:
+        key = f"{normalize_name(artist_name)}\t{normalize_name(album_title)}"
+        return self._get_cached_or_search(
+            "album", key, lambda: self._search_album_id(album_title, artist_name)
+        )
+
+    def _search_album_id(self, album_title, artist_name):
         logging.debug(
             f"Searching for album '{album_title}' by artist '{artist_name}' in MusicBrainz."
         )
-        try:
-            result = musicbrainzngs.search_release_groups(
-                artist=artist_name, release=album_title
-            )
-            logging.debug(f"Raw response from MusicBrainz for album search: {result}")
+        result = musicbrainzngs.search_release_groups(
+            artist=artist_name, release=album_title
+        )
+        logging.debug(f"Raw response from MusicBrainz for album search: {result}")
 
-            album_id = result.get("release-group-list", [{}])[0].get("id")
-            if album_id:
-                logging.debug(
-                    f"Found MusicBrainz ID for album '{album_title}': {album_id}"
-                )
-                return album_id
-            else:
-                logging.warning(
-                    f"No matching MusicBrainz ID found for album '{album_title}' by '{artist_name}'."
-                )
-                return None
-        except Exception as e:
-            logging.error(
-                f"Error fetching MusicBrainz ID for album '{album_title}' by '{artist_name}': {e}"
+        album_id = (result.get("release-group-list") or [{}])[0].get("id")
+        if album_id:
+            logging.debug(f"Found MusicBrainz ID for album '{album_title}': {album_id}")
+        else:
+            logging.warning(
+                f"No matching MusicBrainz ID found for album '{album_title}' by '{artist_name}'."
             )
-            return None
+        return album_id
 
     def get_artist_id(self, artist_name: str) -> str | None:
+        return self._get_cached_or_search(
+            "artist",
+            normalize_name(artist_name),
+            lambda: self._search_artist_id(artist_name),
+        )
+
+    def _search_artist_id(self, artist_name):
         logging.debug(f"Searching for artist '{artist_name}' in MusicBrainz.")
-        try:
-            result = musicbrainzngs.search_artists(artist=artist_name)
-            logging.debug(f"Raw response from MusicBrainz for artist search: {result}")
-
-            artist_id = result.get("artist-list", [{}])[0].get("id")
-            if artist_id:
-                logging.debug(
-                    f"Found MusicBrainz ID for artist '{artist_name}': {artist_id}"
-                )
-                return artist_id
-            else:
-                logging.warning(
-                    f"No matching MusicBrainz ID found for artist '{artist_name}'."
-                )
-                return None
-        except Exception as e:
-            logging.error(
-                f"Error fetching MusicBrainz ID for artist '{artist_name}': {e}"
+        result = musicbrainzngs.search_artists(artist=artist_name)
+        logging.debug(f"Raw response from MusicBrainz for artist search: {result}")
+
+        artist_id = (result.get("artist-list") or [{}])[0].get("id")
+        if artist_id:
+            logging.debug(
+                f"Found MusicBrainz ID for artist '{artist_name}': {artist_id}"
+            )
+        else:
+            logging.warning(
+                f"No matching MusicBrainz ID found for artist '{artist_name}'."
             )
-            return None
+        return artist_id
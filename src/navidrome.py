@@ -1,21 +1,29 @@
 import hashlib
+import json
+import logging
+import math
+import os
 import random
 import string
-import requests
-import logging
-from dataclasses import dataclass, field
+import time
+from dataclasses import dataclass
+from identity import IdentityMap
+from matching import TrackMatcher, strip_title
+from transport import HttpTransport
+from utils import write_json_atomically
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class NavidromeArtist:
     _id: str
     name: str
+    album_count: int | None = None
 
     def __str__(self):
         return f"NavidromeArtist(id='{self._id}', name='{self.name}')"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class NavidromeAlbum:
     _id: str
     artist: NavidromeArtist
@@ -24,7 +32,7 @@ class NavidromeAlbum:
         return f"NavidromeAlbum(id='{self._id}', artist={self.artist})"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class NavidromeTrack:
     _id: str
     title: str
@@ -36,11 +44,11 @@ class NavidromeTrack:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class NavidromePlaylist:
     _id: str
     name: str
-    tracks: list[NavidromeTrack] = field(default_factory=list)
+    tracks: tuple[NavidromeTrack, ...] = ()
 
     def __str__(self):
         track_count = len(self.tracks)
@@ -48,11 +56,35 @@ class NavidromePlaylist:
 
 
 class NavidromeService:
-    def __init__(self, navidrome_url, username, password):
+    def __init__(
+        self,
+        navidrome_url,
+        username,
+        password,
+        transport=None,
+        catalog_path=None,
+        catalog_max_age=3600,
+        catalog_page_size=500,
+        playlist_update_mode="diff",
+        playlist_chunk_size=200,
+        match_threshold=0.8,
+    ):
         logging.debug("Initializing NavidromeService...")
         self.navidrome_url = navidrome_url
         self.username = username
         self.password = password
+        self.transport = (transport or HttpTransport()).for_service("navidrome")
+        self.catalog_path = catalog_path
+        self.catalog_max_age = catalog_max_age
+        self.catalog_page_size = catalog_page_size
+        self.catalog = None
+        self.catalog_song_ids = set()
+        self.identity_map = IdentityMap()
+        self.playlist_update_mode = playlist_update_mode
+        self.playlist_chunk_size = playlist_chunk_size
+        self.match_threshold = match_threshold
+        self.playlist_directory = None
+        self.playlist_ids = set()
         logging.debug(f"Navidrome URL: {self.navidrome_url}, Username: {self.username}")
 
     def generate_salt(self, length=48):
@@ -84,7 +116,7 @@ class NavidromeService:
     def artists(self):
         url = f"{self.navidrome_url}/rest/getArtists"
         logging.debug(f"Fetching artists from Navidrome: {url}")
-        response = requests.get(url, params=self.params)
+        response = self.transport.get(url, params=self.params)
         artists = []
         if response.status_code == 200:
             raw_indexes = (
@@ -100,7 +132,11 @@ class NavidromeService:
 
                 for raw_artist in raw_index["artist"]:
                     artists.append(
-                        NavidromeArtist(_id=raw_artist["id"], name=raw_artist["name"])
+                        NavidromeArtist(
+                            _id=raw_artist["id"],
+                            name=raw_artist["name"],
+                            album_count=raw_artist.get("albumCount"),
+                        )
                     )
 
             logging.info(f"Fetched {len(artists)} artists from Navidrome.")
@@ -109,29 +145,85 @@ class NavidromeService:
 
         return artists
 
-    def get_playlist_or_none(self, playlist_name) -> NavidromePlaylist | None:
-        url = f"{self.navidrome_url}/rest/getPlaylists"
-        logging.debug(f"Fetching playlist '{playlist_name}' from Navidrome: {url}")
-        response = requests.get(url, params=self.params)
-        if response.status_code == 200:
-            playlists = (
-                response.json()
-                .get("subsonic-response", {})
-                .get("playlists", {})
-                .get("playlist", [])
+    def get_indexes(self, if_modified_since=None):
+        """Return (lastModified, artists), artists None if unchanged since then.
+
+        Returns None when the request fails. Index entries carry no album
+        count, which only the ID3 `artists` listing gives.
+        """
+        url = f"{self.navidrome_url}/rest/getIndexes"
+        params = dict(self.params)
+        if if_modified_since is not None:
+            params["ifModifiedSince"] = if_modified_since
+
+        logging.debug(f"Fetching artist indexes modified since {if_modified_since}")
+        response = self.transport.get(url, params=params)
+        if not self._is_ok(response):
+            logging.error(f"Failed to fetch artist indexes: {response.content}")
+            return None
+
+        raw_indexes = response.json()["subsonic-response"].get("indexes", {})
+        last_modified = raw_indexes.get("lastModified")
+        if if_modified_since is not None and "index" not in raw_indexes:
+            logging.info("Navidrome artists unchanged since the last scan.")
+            return last_modified, None
+
+        artists = [
+            NavidromeArtist(
+                _id=raw_artist["id"],
+                name=raw_artist["name"],
+                album_count=raw_artist.get("albumCount"),
             )
-            logging.debug(f"Raw playlists data: {playlists}")
-            for playlist in playlists:
-                if playlist["name"].lower() == playlist_name.lower():
-                    logging.info(
-                        f"Found playlist '{playlist_name}' with ID {playlist['id']}"
-                    )
-                    return NavidromePlaylist(
-                        _id=playlist["id"], name=playlist["name"], tracks=[]
-                    )
-        else:
+            for raw_index in raw_indexes.get("index", [])
+            for raw_artist in raw_index.get("artist", [])
+        ]
+        logging.info(f"Fetched {len(artists)} artists from Navidrome indexes.")
+        return last_modified, artists
+
+    def load_playlist_directory(self):
+        url = f"{self.navidrome_url}/rest/getPlaylists"
+        logging.debug(f"Fetching playlist directory from Navidrome: {url}")
+        response = self.transport.get(url, params=self.params)
+        if not self._is_ok(response):
             logging.error(f"Failed to fetch playlists: {response.content}")
-        return None
+            self.playlist_directory = None
+            self.playlist_ids = set()
+            return
+
+        playlists = (
+            response.json()
+            .get("subsonic-response", {})
+            .get("playlists", {})
+            .get("playlist", [])
+        )
+        logging.debug(f"Raw playlists data: {playlists}")
+        self.playlist_directory = {}
+        self.playlist_ids = {playlist["id"] for playlist in playlists}
+        for playlist in playlists:
+            self.playlist_directory.setdefault(
+                playlist["name"].lower(), (playlist["id"], playlist["name"])
+            )
+        logging.info(f"Loaded {len(self.playlist_directory)} Navidrome playlists.")
+
+    def has_playlist(self, playlist_id) -> bool | None:
+        """Whether the loaded playlist directory holds playlist_id, or None if unknown."""
+        if self.playlist_directory is None:
+            return None
+        return playlist_id in self.playlist_ids
+
+    def get_playlist_or_none(self, playlist_name) -> NavidromePlaylist | None:
+        if self.playlist_directory is None:
+            self.load_playlist_directory()
+            if self.playlist_directory is None:
+                return None
+
+        entry = self.playlist_directory.get(playlist_name.lower())
+        if entry is None:
+            return None
+
+        playlist_id, name = entry
+        logging.info(f"Found playlist '{playlist_name}' with ID {playlist_id}")
+        return NavidromePlaylist(_id=playlist_id, name=name)
 
     def create_playlist(self, playlist_name) -> NavidromePlaylist | None:
         url = f"{self.navidrome_url}/rest/createPlaylist"
@@ -142,10 +234,17 @@ class NavidromeService:
         }
 
         logging.debug(f"Creating playlist '{playlist_name}' with params: {params}")
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
+        # A POST, as the transport retries GETs and a retry creates a duplicate.
+        response = self.transport.post(url, data=params)
+        if self._is_ok(response):
             playlist_id = response.json()["subsonic-response"]["playlist"]["id"]
             logging.info(f"Created playlist '{playlist_name}' with ID {playlist_id}")
+            if self.playlist_directory is not None:
+                self.playlist_directory[playlist_name.lower()] = (
+                    playlist_id,
+                    playlist_name,
+                )
+                self.playlist_ids.add(playlist_id)
 
             return NavidromePlaylist(
                 _id=playlist_id,
@@ -164,79 +263,310 @@ class NavidromeService:
                 f'Playlist "{playlist_name}" already exists with ID {playlist._id}.'
             )
             return playlist
-        else:
-            logging.info(f"Creating new playlist: {playlist_name}")
-            return self.create_playlist(playlist_name)
 
-    def update_playlist(self, playlist: NavidromePlaylist):
-        logging.debug(f"Updating playlist '{playlist.name}'")
-        self.clear_playlist(playlist)
-        self.add_tracks_to_playlist(playlist)
+        logging.info(f"Creating new playlist: {playlist_name}")
+        playlist = self.create_playlist(playlist_name)
+        if playlist is None:
+            # Someone else may have created it since the directory was loaded.
+            self.load_playlist_directory()
+            playlist = self.get_playlist_or_none(playlist_name)
+        return playlist
 
-    def clear_playlist(self, playlist: NavidromePlaylist):
-        url = f"{self.navidrome_url}/rest/updatePlaylist"
-        params = {
-            **self.params,
-            "playlistId": playlist._id,
-            "songId": [],
-        }
+    def _is_ok(self, response):
+        return (
+            response.status_code == 200
+            and response.json().get("subsonic-response", {}).get("status") == "ok"
+        )
 
-        logging.debug(f"Clearing playlist '{playlist.name}' with params: {params}")
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            logging.info(
-                f"Successfully cleared all tracks from playlist '{playlist.name}'."
-            )
-        else:
-            logging.error(
-                f"Failed to clear playlist '{playlist.name}': {response.content}"
-            )
+    def plan_playlist_update(self, playlist: NavidromePlaylist):
+        """Return (playlist_id, indexes_to_remove, ids_to_add) for its `tracks`.
+
+        `playlist_id` differs from the playlist's when it was replaced since
+        the directory was loaded, and is None when it was deleted and must
+        be created before the update is applied.
+        """
+        playlist_id = playlist._id
+        current_ids = self.get_playlist_song_ids_or_none(playlist)
+        if current_ids is None:
+            playlist_id, current_ids = self._resolve_playlist_conflict(playlist)
+        if current_ids is None:
+            logging.error(f"Cannot diff playlist '{playlist.name}', skipping update.")
+            return None
 
-    def add_tracks_to_playlist(self, playlist: NavidromePlaylist):
-        if not playlist.tracks:
-            logging.info(f'No tracks to add to playlist "{playlist.name}".')
-            return
+        desired_ids = [track._id for track in playlist.tracks]
+        if self.playlist_update_mode == "replace":
+            return playlist_id, list(range(len(current_ids))), desired_ids
+        return playlist_id, *diff_playlist(current_ids, desired_ids)
+
+    def _resolve_playlist_conflict(self, playlist):
+        """Return (playlist_id, song_ids) of a playlist deleted or replaced.
+
+        Re-points a playlist replaced since the directory was loaded, and
+        gives a None ID and no songs for one deleted since.
+        """
+        logging.info(f"Refreshing playlist directory for '{playlist.name}'.")
+        self.load_playlist_directory()
+        current = self.get_playlist_or_none(playlist.name)
+        if current is None:
+            return None, []
+
+        if current._id == playlist._id:
+            return playlist._id, None
+        return current._id, self.get_playlist_song_ids_or_none(current)
+
+    def estimate_playlist_update(self, indexes_to_remove, ids_to_add):
+        """Number of updatePlaylist requests `apply_playlist_update` sends."""
+        return math.ceil(len(indexes_to_remove) / self.playlist_chunk_size) + math.ceil(
+            len(ids_to_add) / self.playlist_chunk_size
+        )
+
+    def apply_playlist_update(self, playlist, indexes_to_remove, ids_to_add) -> bool:
+        """Send the update in chunks; False once a chunk fails, leaving the rest."""
+        if not indexes_to_remove and not ids_to_add:
+            logging.info(f"Playlist '{playlist.name}' is already up to date.")
+            return True
+
+        # Remove from the end so pending indexes stay valid between chunks.
+        indexes_to_remove = sorted(indexes_to_remove, reverse=True)
+        for chunk in self._chunks(indexes_to_remove):
+            if not self._post_playlist_update(playlist, "songIndexToRemove", chunk):
+                return False
+        for chunk in self._chunks(ids_to_add):
+            if not self._post_playlist_update(playlist, "songIdToAdd", chunk):
+                return False
+
+        logging.info(
+            f"Updated playlist '{playlist.name}': removed {len(indexes_to_remove)}, "
+            f"added {len(ids_to_add)} tracks."
+        )
+        return True
+
+    def _chunks(self, items):
+        for start in range(0, len(items), self.playlist_chunk_size):
+            yield items[start : start + self.playlist_chunk_size]
 
+    def _post_playlist_update(self, playlist, field_name, values):
         url = f"{self.navidrome_url}/rest/updatePlaylist"
-        track_ids = [track._id for track in playlist.tracks]
-        params = {**self.params, "playlistId": playlist._id, "songId": track_ids}
+        data = {**self.params, "playlistId": playlist._id, field_name: values}
 
         logging.debug(
-            f"Adding tracks to playlist '{playlist.name}' with params: {params}"
+            f"Updating playlist '{playlist.name}' with {len(values)} {field_name}"
         )
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            logging.info(
-                f'Successfully added {len(track_ids)} tracks to playlist "{playlist.name}".'
-            )
-        else:
+        response = self.transport.post(url, data=data)
+        if not self._is_ok(response):
             logging.error(
-                f'Failed to add tracks to playlist "{playlist.name}": {response.content}'
+                f"Failed to update playlist '{playlist.name}': {response.content}"
+            )
+            return False
+        return True
+
+    def get_playlist_song_ids_or_none(self, playlist: NavidromePlaylist):
+        url = f"{self.navidrome_url}/rest/getPlaylist"
+        params = {**self.params, "id": playlist._id}
+
+        logging.debug(f"Fetching contents of playlist '{playlist.name}'")
+        response = self.transport.get(url, params=params)
+        if self._is_ok(response):
+            entries = (
+                response.json()["subsonic-response"]
+                .get("playlist", {})
+                .get("entry", [])
+            )
+            return [entry["id"] for entry in entries]
+
+        logging.error(f"Failed to fetch playlist '{playlist.name}': {response.content}")
+        return None
+
+    def sync_catalog(self):
+        raw_songs = self._read_catalog_store()
+        if not raw_songs:
+            raw_songs = self._fetch_catalog()
+            if not raw_songs:
+                # An empty catalog would read as every track missing from Navidrome.
+                if raw_songs is not None:
+                    logging.warning(
+                        "Navidrome returned an empty catalog, falling back to search."
+                    )
+                self.catalog = None
+                self.catalog_song_ids = set()
+                return
+            self._write_catalog_store(raw_songs)
+
+        catalog = TrackMatcher(threshold=self.match_threshold)
+        self.catalog_song_ids = set()
+        self.identity_map.clear()
+        for raw_song in raw_songs:
+            track = self._load_track_from_raw(raw_song)
+            self.catalog_song_ids.add(track._id)
+            catalog.add(
+                track,
+                (raw_song.get("artist"), raw_song.get("displayAlbumArtist")),
+                raw_song.get("album"),
+            )
+        self.catalog = catalog
+
+        logging.info(f"Navidrome catalog loaded with {len(raw_songs)} songs.")
+
+    def _fetch_catalog(self):
+        url = f"{self.navidrome_url}/rest/search3"
+        raw_songs = []
+        while True:
+            params = {
+                **self.params,
+                "query": "",
+                "artistCount": 0,
+                "albumCount": 0,
+                "songCount": self.catalog_page_size,
+                "songOffset": len(raw_songs),
+            }
+            logging.debug(f"Fetching Navidrome songs from offset {len(raw_songs)}")
+            response = self.transport.get(url, params=params)
+            if not self._is_ok(response):
+                logging.error(
+                    f"Failed to sync Navidrome catalog, falling back to search: {response.content}"
+                )
+                return None
+
+            page = (
+                response.json()
+                .get("subsonic-response", {})
+                .get("searchResult3", {})
+                .get("song", [])
+            )
+            raw_songs.extend(
+                {
+                    key: raw_song[key]
+                    for key in (
+                        "id",
+                        "title",
+                        "artist",
+                        "artistId",
+                        "album",
+                        "albumId",
+                        "displayAlbumArtist",
+                    )
+                    if key in raw_song
+                }
+                for raw_song in page
             )
+            if len(page) < self.catalog_page_size:
+                return raw_songs
+
+    def has_song(self, song_id) -> bool | None:
+        """Whether the synced catalog contains song_id, or None if unknown."""
+        if self.catalog is None:
+            return None
+        return song_id in self.catalog_song_ids
+
+    def _read_catalog_store(self):
+        if not self.catalog_path or not os.path.exists(self.catalog_path):
+            return None
+
+        age = time.time() - os.path.getmtime(self.catalog_path)
+        if age > self.catalog_max_age:
+            logging.debug(f"Navidrome catalog store is {age:.0f}s old, resyncing.")
+            return None
+
+        try:
+            with open(self.catalog_path, encoding="utf-8") as catalog_file:
+                return json.load(catalog_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable Navidrome catalog store: {e}")
+            return None
+
+    def _write_catalog_store(self, raw_songs):
+        if not self.catalog_path:
+            return
+
+        if write_json_atomically(self.catalog_path, raw_songs, "Navidrome catalog"):
+            logging.debug(f"Navidrome catalog stored at {self.catalog_path}")
+
+    def _load_track_from_raw(self, raw_track):
+        artist = self.identity_map.get(
+            NavidromeArtist,
+            (raw_track.get("artistId"), raw_track.get("artist")),
+            _id=raw_track.get("artistId"),
+            name=raw_track.get("artist"),
+        )
+        album = self.identity_map.get(
+            NavidromeAlbum,
+            (raw_track.get("albumId"), artist),
+            _id=raw_track.get("albumId"),
+            artist=artist,
+        )
+        return NavidromeTrack(
+            _id=raw_track["id"], title=raw_track["title"], album=album
+        )
 
     def get_track_or_none(
-        self, artist_name: str, track_title: str
+        self, artist_name: str, track_title: str, album_title: str | None = None
     ) -> NavidromeTrack | None:
+        return self.find_track(artist_name, track_title, album_title)[1]
+
+    def find_track(
+        self, artist_name: str, track_title: str, album_title: str | None = None
+    ) -> tuple[bool, NavidromeTrack | None]:
+        """Return (found, track); found is False when the search failed.
+
+        A None track with found True means the library has no such track.
+        """
+        if self.catalog is not None:
+            track = self.catalog.match(artist_name, track_title, album_title)
+            logging.debug(
+                f"Catalog match for '{track_title}' by '{artist_name}': {track}"
+            )
+            return True, track
+
+        return self.search_track(artist_name, track_title, album_title)
+
+    def search_track(
+        self, artist_name: str, track_title: str, album_title: str | None = None
+    ) -> tuple[bool, NavidromeTrack | None]:
         url = f"{self.navidrome_url}/rest/search3"
-        params = {**self.params, "query": f"{artist_name} {track_title}"}
+        # Version suffixes like "- Remastered 2011" would narrow the search.
+        query_title, _ = strip_title(track_title)
+        params = {**self.params, "query": f"{artist_name} {query_title}"}
 
         logging.debug(
             f"Searching for track '{track_title}' by '{artist_name}' with params: {params}"
         )
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            search_result = response.json().get("subsonic-response", {}).get("song", [])
+        response = self.transport.get(url, params=params)
+        if self._is_ok(response):
+            search_result = (
+                response.json()
+                .get("subsonic-response", {})
+                .get("searchResult3", {})
+                .get("song", [])
+            )
             logging.debug(f"Search result for track: {search_result}")
-            if search_result:
-                track = search_result[0]
-                artist = NavidromeArtist(_id=track["artistId"], name=track["artist"])
-                album = NavidromeAlbum(_id=track["albumId"], artist=artist)
-
-                return NavidromeTrack(
-                    _id=track["id"], title=track["title"], album=album
+            candidates = TrackMatcher(threshold=self.match_threshold)
+            for raw_song in search_result:
+                candidates.add(
+                    self._load_track_from_raw(raw_song),
+                    (raw_song.get("artist"), raw_song.get("displayAlbumArtist")),
+                    raw_song.get("album"),
                 )
+            return True, candidates.match(artist_name, track_title, album_title)
         else:
             logging.error(
                 f"Failed to search for track '{track_title}' by '{artist_name}': {response.content}"
             )
-        return None
+        return False, None
+
+
+def diff_playlist(current_ids, desired_ids):
+    """Return (indexes to remove, ids to append) turning current into desired.
+
+    Subsonic can only append songs, so the longest prefix of desired_ids that
+    is already a subsequence of current_ids is kept and everything else in
+    current_ids is removed.
+    """
+    kept = 0
+    indexes_to_remove = []
+    for index, song_id in enumerate(current_ids):
+        if kept < len(desired_ids) and song_id == desired_ids[kept]:
+            kept += 1
+        else:
+            indexes_to_remove.append(index)
+
+    return indexes_to_remove, list(desired_ids[kept:])
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncPipeline:
+    """Runs a PlaylistManager pass as pipelined asyncio stages.
+
+    Spotify playlists are streamed for several artists and categories at
+    once and queued as soon as each one loads. Resolver tasks resolve the
+    tracks of each playlist concurrently, and planner tasks diff them
+    against the Navidrome playlists into the manager's plan. Blocking
+    service calls run on a thread pool. Per-backend limits come from the
+    ConcurrencyLimitedService proxies wrapping the manager's services, and
+    from SpotifyService itself, which caps its requests in flight.
+    """
+
+    def __init__(self, manager, workers=4, threads=32):
+        self.manager = manager
+        self.workers = workers
+        self.threads = threads
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            loop.set_default_executor(executor)
+
+            playlists = asyncio.Queue(maxsize=self.workers * 2)
+            resolved = asyncio.Queue(maxsize=self.workers * 2)
+
+            resolvers = [
+                asyncio.create_task(self._resolve_stage(playlists, resolved))
+                for _ in range(self.workers)
+            ]
+            planners = [
+                asyncio.create_task(self._plan_stage(resolved))
+                for _ in range(self.workers)
+            ]
+
+            try:
+                await self._fetch_stage(playlists)
+                await playlists.join()
+                await resolved.join()
+            finally:
+                for task in resolvers + planners:
+                    task.cancel()
+                await asyncio.gather(*resolvers, *planners, return_exceptions=True)
+
+    async def _fetch_stage(self, playlists):
+        manager = self.manager
+        artists, random_categories = await asyncio.gather(
+            asyncio.to_thread(manager.get_artists),
+            asyncio.to_thread(manager.get_random_categories),
+        )
+
+        # Each open playlist stream keeps its own prefetching thread pools.
+        streams = asyncio.Semaphore(self.workers)
+
+        async def fetch(iter_playlists, *args):
+            async with streams:
+                spotify_playlists = iter_playlists(*args)
+                try:
+                    while True:
+                        # Playlists are queued one by one as they load.
+                        spotify_playlist = await asyncio.to_thread(
+                            next, spotify_playlists, None
+                        )
+                        if spotify_playlist is None:
+                            break
+                        await playlists.put(spotify_playlist)
+                except Exception as e:
+                    logging.error(f"Failed to fetch Spotify playlists for {args}: {e}")
+                finally:
+                    await asyncio.to_thread(spotify_playlists.close)
+
+        await asyncio.gather(
+            *(fetch(manager.iter_playlists_for_artist, artist) for artist in artists),
+            *(
+                fetch(manager.iter_playlists_for_category, category)
+                for category in manager.included_categories
+            ),
+            *(
+                fetch(manager.iter_playlists_for_category, category["id"])
+                for category in random_categories
+            ),
+        )
+        logging.debug("All Spotify playlists fetched.")
+
+    async def _resolve_stage(self, playlists, resolved):
+        while True:
+            spotify_playlist = await playlists.get()
+            started_at = time.perf_counter()
+            try:
+                logging.info(f"Processing playlist: {spotify_playlist.name}")
+                navidrome_tracks = await asyncio.gather(
+                    *(
+                        asyncio.to_thread(self.manager.process_track, spotify_track)
+                        for spotify_track in spotify_playlist.tracks
+                    )
+                )
+                await resolved.put(
+                    (
+                        spotify_playlist,
+                        [track for track in navidrome_tracks if track],
+                        started_at,
+                    )
+                )
+            except Exception as e:
+                logging.error(
+                    f"Failed to process playlist {spotify_playlist.name}: {e}"
+                )
+            finally:
+                playlists.task_done()
+
+    async def _plan_stage(self, resolved):
+        while True:
+            spotify_playlist, navidrome_tracks, started_at = await resolved.get()
+            try:
+                await asyncio.to_thread(
+                    self.manager.plan_playlist, spotify_playlist, navidrome_tracks
+                )
+                if self.manager.profiler:
+                    self.manager.profiler.record_playlist(
+                        spotify_playlist, time.perf_counter() - started_at
+                    )
+            except Exception as e:
+                logging.error(f"Failed to plan playlist {spotify_playlist.name}: {e}")
+            finally:
+                resolved.task_done()
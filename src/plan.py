@@ -0,0 +1,115 @@
+import json
+import threading
+from dataclasses import dataclass, field
+
+
+@dataclass
+class PlaylistChange:
+    name: str
+    spotify_playlist_id: str
+    snapshot_id: str | None
+    track_ids: list[str]
+    navidrome_playlist_id: str | None = None
+    indexes_to_remove: list[int] = field(default_factory=list)
+    ids_to_add: list[str] = field(default_factory=list)
+
+    @property
+    def creates_playlist(self):
+        return self.navidrome_playlist_id is None
+
+    def __str__(self):
+        return (
+            f"PlaylistChange(name='{self.name}', id={self.navidrome_playlist_id}, "
+            f"remove={len(self.indexes_to_remove)}, add={len(self.ids_to_add)})"
+        )
+
+
+class Plan:
+    """Deduplicated writes resolved by the planning phase of a run.
+
+    Lidarr additions and monitors come from the LidarrService queues, and
+    playlist changes are keyed by Navidrome playlist name so a later Spotify
+    playlist with the same name replaces the earlier one, as it would have
+    overwritten it when written directly.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.albums_to_add = []
+        self.albums_to_monitor = []
+        self.playlist_changes = {}
+        self.estimated_requests = {}
+
+    def add_playlist_change(self, change: PlaylistChange):
+        with self.lock:
+            self.playlist_changes[change.name.lower()] = change
+
+    @property
+    def playlists_to_create(self):
+        return [
+            change
+            for change in self.playlist_changes.values()
+            if change.creates_playlist
+        ]
+
+    @property
+    def playlist_diffs(self):
+        return [
+            change
+            for change in self.playlist_changes.values()
+            if not change.creates_playlist
+            and (change.indexes_to_remove or change.ids_to_add)
+        ]
+
+    def action_counts(self):
+        return {
+            "albums_to_add": len(self.albums_to_add),
+            "albums_to_monitor": len(self.albums_to_monitor),
+            "playlists_to_create": len(self.playlists_to_create),
+            "playlist_diffs": len(self.playlist_diffs),
+        }
+
+    def to_dict(self):
+        return {
+            "albums_to_add": [
+                {
+                    "title": album.title,
+                    "artist": album.artist.name,
+                    "quality_profile": quality_profile.name,
+                    "metadata_profile": metadata_profile.name,
+                }
+                for album, quality_profile, metadata_profile in self.albums_to_add
+            ],
+            "albums_to_monitor": [
+                {"id": album._id, "title": album.title, "artist": album.artist.name}
+                for album in self.albums_to_monitor
+            ],
+            "playlists_to_create": [
+                {
+                    "name": change.name,
+                    "spotify_playlist_id": change.spotify_playlist_id,
+                    "track_ids": change.ids_to_add,
+                }
+                for change in self.playlists_to_create
+            ],
+            "playlist_diffs": [
+                {
+                    "name": change.name,
+                    "id": change.navidrome_playlist_id,
+                    "spotify_playlist_id": change.spotify_playlist_id,
+                    "indexes_to_remove": change.indexes_to_remove,
+                    "ids_to_add": change.ids_to_add,
+                }
+                for change in self.playlist_diffs
+            ],
+            "estimated_requests": self.estimated_requests,
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def __str__(self):
+        counts = ", ".join(
+            f"{action}={count}" for action, count in self.action_counts().items()
+        )
+        return f"Plan({counts})"
@@ -1,8 +1,20 @@
 import logging
 import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
 from lidarr import LidarrAlbum, LidarrArtist
+from memo import RunMemo
+from metrics import PLAN_ACTIONS, observe_phase
 from navidrome import NavidromePlaylist, NavidromeTrack
-from spotify import SpotifyPlaylist
+from pipeline import AsyncPipeline
+from plan import Plan, PlaylistChange
+from spotify import SpotifyPlaylist, SpotifyTrack
+from utils import normalize_name
 
 
 class PlaylistManager:
@@ -18,11 +30,31 @@ class PlaylistManager:
         random_category_limit,
         quality_profile_name,
         metadata_profile_name,
+        sync_state=None,
+        track_mappings=None,
+        artist_scan=None,
+        mode="sequential",
+        workers=4,
+        profiler=None,
     ):
         logging.debug("Initializing PlaylistManager...")
         self.spotify = spotify
         self.lidarr = lidarr
         self.navidrome = navidrome
+        self.sync_state = sync_state
+        self.track_mappings = track_mappings
+        self.artist_scan = artist_scan
+        self.mode = mode
+        self.workers = workers
+        self.profiler = profiler
+        self.memo = RunMemo()
+        self.album_locks = {}
+        self.plan = None
+
+        if self.mode == "threaded":
+            # Separate pools so playlist workers never wait on their own pool.
+            self.playlist_executor = ThreadPoolExecutor(max_workers=workers)
+            self.track_executor = ThreadPoolExecutor(max_workers=workers)
         self.artist_playlist_limit = artist_playlist_limit
         self.category_playlist_limit = category_playlist_limit
         self.included_categories = [cat.lower() for cat in included_categories if cat]
@@ -64,132 +96,416 @@ class PlaylistManager:
             f"Metadata profile '{metadata_profile_name}' found with ID: {self.metadata_profile._id}"
         )
 
-    def process(self):
+    def process(self, dry_run=False):
         logging.debug(
             "Starting to process playlists by artists, categories, and random categories."
         )
-        self.process_playlists_by_artists()
-        self.process_playlists_by_included_categories()
-        self.process_playlists_by_random_categories()
+        if self.profiler:
+            self.profiler.start()
 
-    def process_playlists_by_artists(self):
-        logging.debug("Processing playlists by artists.")
-        for artist in self.navidrome.artists:
-            lidarr_artist = self.lidarr.get_artist_or_none(artist.name)
-            logging.debug(f"Fetched Lidarr artist: {lidarr_artist}")
-            if lidarr_artist and lidarr_artist.is_monitored:
-                logging.info(
-                    f"Fetching playlists for fully monitored artist: {artist.name}"
-                )
-                spotify_playlists = self.spotify.get_playlists_for_artist(
-                    artist.name, self.artist_playlist_limit
+        plan = None
+        try:
+            with self.phase("load_indexes"):
+                self.lidarr.load_artist_index()
+                self.lidarr.load_album_index()
+                self.navidrome.sync_catalog()
+                self.navidrome.load_playlist_directory()
+            self.lidarr.musicbrainz.clear_memo()
+            self.spotify.clear_identity_map()
+            self.memo.clear()
+
+            with self.phase("build_plan"):
+                plan = self.build_plan()
+            logging.info(
+                f"Built {plan}, estimated requests (at most): {plan.estimated_requests}"
+            )
+            for action, count in plan.action_counts().items():
+                PLAN_ACTIONS.labels(action).inc(count)
+
+            if not dry_run:
+                with self.phase("execute_plan"):
+                    self.execute_plan(plan)
+        finally:
+            if self.profiler:
+                self.profiler.stop(
+                    mode=self.mode,
+                    dry_run=dry_run,
+                    plan=plan.action_counts() if plan else None,
                 )
-                logging.debug(
-                    f"Fetched Spotify playlists for artist '{artist.name}': {spotify_playlists}"
+        return plan
+
+    @contextmanager
+    def phase(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+            observe_phase(name, duration)
+            if self.profiler:
+                self.profiler.record_phase(name, duration)
+
+    @contextmanager
+    def playlist_timer(self, spotify_playlist):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.profiler:
+                self.profiler.record_playlist(
+                    spotify_playlist, time.perf_counter() - started_at
                 )
-                self.process_playlists(spotify_playlists)
-            else:
-                logging.info(
-                    f"Skipping artist {artist.name} because they are not fully monitored in Lidarr."
+
+    def build_plan(self):
+        """Resolve every playlist and track without writing to Lidarr or Navidrome."""
+        self.plan = Plan()
+        if self.mode == "async":
+            with self.phase("async_pipeline"):
+                AsyncPipeline(self, workers=self.workers).run()
+        else:
+            with self.phase("process_playlists_by_artists"):
+                self.process_playlists_by_artists()
+            with self.phase("process_playlists_by_included_categories"):
+                self.process_playlists_by_included_categories()
+            with self.phase("process_playlists_by_random_categories"):
+                self.process_playlists_by_random_categories()
+
+        plan = self.plan
+        plan.albums_to_add, plan.albums_to_monitor = self.lidarr.take_pending_writes()
+        plan.estimated_requests = self.estimate_requests(plan)
+        return plan
+
+    def estimate_requests(self, plan: Plan):
+        """Upper bounds of the requests `execute_plan` sends, reads included.
+
+        MusicBrainz fallbacks are listed apart from the total, as the
+        MusicBrainz cache answers most of them.
+        """
+        lidarr_requests, musicbrainz_requests = self.lidarr.estimate_album_writes(
+            plan.albums_to_add, plan.albums_to_monitor
+        )
+        navidrome_requests = sum(
+            int(change.creates_playlist)
+            + self.navidrome.estimate_playlist_update(
+                change.indexes_to_remove, change.ids_to_add
+            )
+            for change in plan.playlist_changes.values()
+        )
+        return {
+            "lidarr": lidarr_requests,
+            "navidrome": navidrome_requests,
+            "total": lidarr_requests + navidrome_requests,
+            "musicbrainz_fallbacks": musicbrainz_requests,
+        }
+
+    def execute_plan(self, plan: Plan):
+        logging.info(f"Executing {plan}")
+        self.lidarr.apply_album_writes(plan.albums_to_add, plan.albums_to_monitor)
+
+        # Creations first, so diffs of existing playlists run back to back.
+        changes = sorted(
+            plan.playlist_changes.values(),
+            key=lambda change: not change.creates_playlist,
+        )
+        if self.mode == "threaded":
+            list(self.playlist_executor.map(self.apply_playlist_change, changes))
+        else:
+            for change in changes:
+                self.apply_playlist_change(change)
+
+        if self.sync_state:
+            self.sync_state.save()
+        if self.artist_scan:
+            self.artist_scan.save()
+
+    def apply_playlist_change(self, change: PlaylistChange):
+        navidrome_playlist = NavidromePlaylist(
+            _id=change.navidrome_playlist_id, name=change.name
+        )
+        if change.creates_playlist:
+            navidrome_playlist = self.navidrome.get_or_create_playlist(change.name)
+            if not navidrome_playlist:
+                logging.error(
+                    f"Skipping playlist {change.name}: no Navidrome playlist."
                 )
+                return
 
-    def process_playlists_by_included_categories(self):
-        logging.debug("Processing playlists by included categories.")
-        for spotify_included_category in self.included_categories:
+        updated = self.navidrome.apply_playlist_update(
+            navidrome_playlist, change.indexes_to_remove, change.ids_to_add
+        )
+
+        # A failed update is retried next run rather than skipped as synced.
+        if updated and self.sync_state:
+            self.sync_state.record(
+                change.spotify_playlist_id,
+                change.snapshot_id,
+                navidrome_playlist._id,
+                change.track_ids,
+            )
+
+    @property
+    def skip_playlist(self):
+        return self.is_synced if self.sync_state else None
+
+    def is_synced(self, spotify_playlist_id, snapshot_id):
+        """True when the snapshot was synced and its Navidrome playlist still exists."""
+        return self.sync_state.is_unchanged(spotify_playlist_id, snapshot_id) and bool(
+            self.navidrome.has_playlist(
+                self.sync_state.navidrome_playlist_id(spotify_playlist_id)
+            )
+        )
+
+    def get_artists(self):
+        if not self.artist_scan:
+            return self.navidrome.artists
+
+        # getIndexes tells whether the library changed; the ID3 listing gives
+        # the album counts that show which artists did.
+        indexes = self.navidrome.get_indexes(self.artist_scan.last_modified)
+        last_modified = None
+        if indexes is not None:
+            last_modified, changed_artists = indexes
+            if changed_artists is None:
+                return self.artist_scan.select(None, last_modified)
+
+        artists = self.navidrome.artists
+        if not artists:
+            # Keep the stored listing, and check the library again next run.
+            return self.artist_scan.select(None)
+        return self.artist_scan.select(artists, last_modified)
+
+    def iter_playlists_for_artist(self, artist):
+        """Yield the artist's Spotify playlists as they load.
+
+        The artist only counts as scanned once every playlist was consumed.
+        """
+        lidarr_artist = self.lidarr.get_artist_or_none(artist.name)
+        logging.debug(f"Fetched Lidarr artist: {lidarr_artist}")
+        if not lidarr_artist or not lidarr_artist.is_monitored:
             logging.info(
-                f"Fetching playlists for included category: {spotify_included_category}"
+                f"Skipping artist {artist.name} because they are not fully monitored in Lidarr."
             )
-            spotify_playlists = self.spotify.get_playlists_for_category(
-                spotify_included_category, self.category_playlist_limit
+        else:
+            logging.info(
+                f"Fetching playlists for fully monitored artist: {artist.name}"
             )
+            for spotify_playlist in self.spotify.iter_playlists_for_artist(
+                artist.name, self.artist_playlist_limit, self.skip_playlist
+            ):
+                logging.debug(
+                    f"Fetched Spotify playlist for artist '{artist.name}': {spotify_playlist}"
+                )
+                yield spotify_playlist
+
+        if self.artist_scan:
+            self.artist_scan.mark_processed(artist)
+
+    def iter_playlists_for_category(self, category_id):
+        for spotify_playlist in self.spotify.iter_playlists_for_category(
+            category_id, self.category_playlist_limit, self.skip_playlist
+        ):
             logging.debug(
-                f"Fetched Spotify playlists for category '{spotify_included_category}': {spotify_playlists}"
+                f"Fetched Spotify playlist for category '{category_id}': {spotify_playlist}"
             )
-            self.process_playlists(spotify_playlists)
+            yield spotify_playlist
 
-    def process_playlists_by_random_categories(self):
-        logging.debug("Processing playlists by random categories.")
+    def get_random_categories(self):
         spotify_categories = self.spotify.get_categories(
             limit=self.random_category_limit,
             excluded_categories=self.excluded_categories,
         )
         logging.debug(f"Fetched Spotify categories: {spotify_categories}")
-        for spotify_category in spotify_categories:
+        return spotify_categories
+
+    def process_playlists_by_artists(self):
+        logging.debug("Processing playlists by artists.")
+        for artist in self.get_artists():
+            self.process_playlists(self.iter_playlists_for_artist(artist))
+
+    def process_playlists_by_included_categories(self):
+        logging.debug("Processing playlists by included categories.")
+        for spotify_included_category in self.included_categories:
             logging.info(
-                f'Fetching playlists for random category: {spotify_category["name"]}'
+                f"Fetching playlists for included category: {spotify_included_category}"
             )
-            spotify_playlists = self.spotify.get_playlists_for_category(
-                spotify_category["id"], self.category_playlist_limit
+            self.process_playlists(
+                self.iter_playlists_for_category(spotify_included_category)
             )
-            logging.debug(
-                f"Fetched Spotify playlists for random category '{spotify_category['name']}': {spotify_playlists}"
+
+    def process_playlists_by_random_categories(self):
+        logging.debug("Processing playlists by random categories.")
+        for spotify_category in self.get_random_categories():
+            logging.info(
+                f'Fetching playlists for random category: {spotify_category["name"]}'
+            )
+            self.process_playlists(
+                self.iter_playlists_for_category(spotify_category["id"])
             )
-            self.process_playlists(spotify_playlists)
 
-    def process_playlists(self, spotify_playlists: list[SpotifyPlaylist]):
-        logging.debug(f"Processing {len(spotify_playlists)} playlists.")
-        for spotify_playlist in spotify_playlists:
-            self.process_playlist(spotify_playlist)
+    def process_playlists(self, spotify_playlists: Iterable[SpotifyPlaylist]):
+        """Process playlists as the iterable yields them."""
+        processed = 0
+        if self.mode == "threaded":
+            # Unlike executor.map, only pull a playlist once a worker is free.
+            futures = deque()
+            for spotify_playlist in spotify_playlists:
+                futures.append(
+                    self.playlist_executor.submit(
+                        self.process_playlist, spotify_playlist
+                    )
+                )
+                if len(futures) >= self.workers:
+                    futures.popleft().result()
+                    processed += 1
+            # Wait for the rest, re-raising worker exceptions.
+            while futures:
+                futures.popleft().result()
+                processed += 1
+        else:
+            for spotify_playlist in spotify_playlists:
+                self.process_playlist(spotify_playlist)
+                processed += 1
+        logging.debug(f"Processed {processed} playlists.")
 
     def process_playlist(self, spotify_playlist: SpotifyPlaylist):
         logging.info(f"Processing playlist: {spotify_playlist.name}")
+        with self.playlist_timer(spotify_playlist):
+            self.plan_playlist(
+                spotify_playlist, self.process_tracks_in_playlist(spotify_playlist)
+            )
 
-        navidrome_playlist = self.navidrome.get_or_create_playlist(
+    def plan_playlist(self, spotify_playlist: SpotifyPlaylist, navidrome_tracks):
+        navidrome_playlist = self.navidrome.get_playlist_or_none(
             spotify_playlist.name
-        )
-        logging.debug(f"Fetched or created Navidrome playlist: {navidrome_playlist}")
-        navidrome_playlist.tracks = self.process_tracks_in_playlist(spotify_playlist)
+        ) or NavidromePlaylist(_id=None, name=spotify_playlist.name)
+        logging.debug(f"Fetched Navidrome playlist: {navidrome_playlist}")
+        navidrome_playlist = replace(navidrome_playlist, tracks=tuple(navidrome_tracks))
+
+        if navidrome_playlist._id is None:
+            update = None, [], [track._id for track in navidrome_tracks]
+        else:
+            update = self.navidrome.plan_playlist_update(navidrome_playlist)
+            if update is None:
+                return
 
-        self.navidrome.update_playlist(navidrome_playlist)
+        navidrome_playlist_id, indexes_to_remove, ids_to_add = update
+        self.plan.add_playlist_change(
+            PlaylistChange(
+                name=navidrome_playlist.name,
+                spotify_playlist_id=spotify_playlist._id,
+                snapshot_id=spotify_playlist.snapshot_id,
+                track_ids=[track._id for track in navidrome_tracks],
+                navidrome_playlist_id=navidrome_playlist_id,
+                indexes_to_remove=indexes_to_remove,
+                ids_to_add=ids_to_add,
+            )
+        )
 
     def process_tracks_in_playlist(self, spotify_playlist: SpotifyPlaylist):
         logging.debug(f"Processing tracks in playlist: {spotify_playlist.name}")
-        navidrome_tracks = []
-        for spotify_track in spotify_playlist.tracks:
-            lidarr_artist = self.lidarr.get_artist_or_none(
-                spotify_track.album.artist.name
-            )
-            logging.debug(
-                f"Fetched Lidarr artist for track '{spotify_track.title}': {lidarr_artist}"
+        if self.mode == "threaded":
+            # map() yields results in playlist order whatever the completion order.
+            resolved_tracks = self.track_executor.map(
+                self.process_track, spotify_playlist.tracks
             )
+        else:
+            resolved_tracks = map(self.process_track, spotify_playlist.tracks)
 
-            lidarr_album = None
-            if not lidarr_artist:
-                logging.error(
-                    f"No matching artist found for track '{spotify_track.title}' by '{spotify_track.album.artist.name}' in Lidarr."
-                )
-                continue
+        navidrome_tracks = []
+        for navidrome_track in resolved_tracks:
+            if navidrome_track:
+                logging.debug(f"Adding Navidrome track: {navidrome_track.title}")
+                navidrome_tracks.append(navidrome_track)
+
+        return navidrome_tracks
+
+    def process_track(self, spotify_track: SpotifyTrack):
+        spotify_artist = spotify_track.album.artist
+        lidarr_artist = self.memo.get_or_compute(
+            "lidarr_artist",
+            spotify_artist._id,
+            lambda: self.lidarr.get_artist_or_none(spotify_artist.name),
+        )
+        logging.debug(
+            f"Fetched Lidarr artist for track '{spotify_track.title}': {lidarr_artist}"
+        )
 
-            lidarr_album = self.lidarr.get_album_or_none(
-                spotify_track.album.title, lidarr_artist
+        if not lidarr_artist:
+            logging.error(
+                f"No matching artist found for track '{spotify_track.title}' by '{spotify_artist.name}' in Lidarr."
             )
+            return None
 
-            if not lidarr_album:
-                logging.info(
-                    f"No matching local album found for track '{spotify_track.title}' by '{spotify_track.album.artist.name}' in Lidarr."
-                )
-                lidarr_album = LidarrAlbum(
-                    artist=lidarr_artist,
-                    title=spotify_track.album.title,
-                    is_monitored=True,
-                )
+        self.memo.get_or_compute(
+            "lidarr_album",
+            (spotify_track.album._id, spotify_artist._id),
+            lambda: self.process_album_once(spotify_track, lidarr_artist),
+        )
 
-                self.lidarr.add_album(
-                    lidarr_album, self.quality_profile, self.metadata_profile
-                )
-                logging.debug(f"Created Lidarr album: {lidarr_album}")
+        return self.memo.get_or_compute(
+            "navidrome_track",
+            spotify_track._id,
+            lambda: self.resolve_navidrome_track(spotify_track),
+        )
 
-            if not lidarr_album.is_monitored:
+    def resolve_navidrome_track(self, spotify_track: SpotifyTrack):
+        if self.track_mappings:
+            found, navidrome_track = self.track_mappings.get(spotify_track._id)
+            if found and (
+                navidrome_track is None
+                or self.navidrome.has_song(navidrome_track._id) is not False
+            ):
+                logging.debug(
+                    f"Mapped track '{spotify_track.title}' from store: {navidrome_track}"
+                )
+                return navidrome_track
+            if found:
                 logging.info(
-                    f"Album {lidarr_album.title} by {lidarr_album.artist.name} exists but is not monitored. Monitoring it now..."
+                    f"Navidrome song {navidrome_track._id} for '{spotify_track.title}' no longer exists."
                 )
-                self.lidarr.monitor_album(lidarr_album)
+                self.track_mappings.invalidate(spotify_track._id)
+
+        found, navidrome_track = self.navidrome.find_track(
+            spotify_track.album.artist.name,
+            spotify_track.title,
+            spotify_track.album.title,
+        )
+        # A failed search is retried next run rather than stored as missing.
+        if found and self.track_mappings:
+            self.track_mappings.set(spotify_track._id, navidrome_track)
+        return navidrome_track
 
-            navidrome_track = self.navidrome.get_track_or_none(
-                spotify_track.album.artist.name, spotify_track.title
+    def process_album_once(self, spotify_track: SpotifyTrack, lidarr_artist):
+        # Distinct Spotify albums can share a title, e.g. regional releases.
+        album_lock = self.album_locks.setdefault(
+            (lidarr_artist.name, normalize_name(spotify_track.album.title)),
+            threading.Lock(),
+        )
+        with album_lock:
+            self.process_album(spotify_track, lidarr_artist)
+
+    def process_album(self, spotify_track: SpotifyTrack, lidarr_artist):
+        lidarr_album = self.lidarr.get_album_or_none(
+            spotify_track.album.title, lidarr_artist
+        )
+
+        if not lidarr_album:
+            logging.info(
+                f"No matching local album found for track '{spotify_track.title}' by '{spotify_track.album.artist.name}' in Lidarr."
+            )
+            lidarr_album = LidarrAlbum(
+                artist=lidarr_artist,
+                title=spotify_track.album.title,
+                is_monitored=True,
             )
-            if navidrome_track:
-                logging.debug(f"Adding Navidrome track: {navidrome_track.title}")
-                navidrome_tracks.append(navidrome_track)
 
-        return navidrome_tracks
+            self.lidarr.add_album(
+                lidarr_album, self.quality_profile, self.metadata_profile
+            )
+            logging.debug(f"Created Lidarr album: {lidarr_album}")
+
+        if not lidarr_album.is_monitored:
+            logging.info(
+                f"Album {lidarr_album.title} by {lidarr_album.artist.name} exists but is not monitored. Monitoring it now..."
+            )
+            self.lidarr.monitor_album(lidarr_album)
@@ -0,0 +1,116 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+
+class RunProfiler:
+    """Collects timings and memory use of one PlaylistManager.process run.
+
+    Phases and playlists are timed by wall clock and counted, tracemalloc
+    tracks the peak and top allocators across all threads, and cProfile
+    optionally profiles the thread calling process(). Each run ends with a
+    JSON report (and a .prof dump) written to report_dir.
+    """
+
+    def __init__(self, report_dir, cprofile=False, top_allocators=20):
+        self.report_dir = report_dir
+        self.cprofile = cprofile
+        self.top_allocators = top_allocators
+        self.lock = threading.Lock()
+        self.profile = None
+        self.started_at = None
+        self.phases = {}
+        self.playlists = {}
+
+    def start(self):
+        self.started_at = time.time()
+        self.phases = {}
+        self.playlists = {}
+        tracemalloc.start()
+        if self.cprofile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def _record(self, timings, key, duration, **details):
+        with self.lock:
+            timing = timings.setdefault(key, {"calls": 0, "wall_time": 0.0})
+            timing["calls"] += 1
+            timing["wall_time"] += duration
+            timing.update(details)
+
+    def record_phase(self, name, duration):
+        self._record(self.phases, name, duration)
+
+    def record_playlist(self, spotify_playlist, duration):
+        self._record(
+            self.playlists,
+            spotify_playlist._id,
+            duration,
+            name=spotify_playlist.name,
+            tracks=len(spotify_playlist.tracks),
+        )
+
+    def stop(self, **summary):
+        """Finish the run and write its report; returns the report path."""
+        if self.profile:
+            self.profile.disable()
+
+        _, peak_memory = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        run_name = datetime.fromtimestamp(self.started_at).strftime("run-%Y%m%dT%H%M%S")
+        report = {
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "wall_time": time.time() - self.started_at,
+            **summary,
+            "phases": self.phases,
+            "playlists": sorted(
+                (
+                    {"id": playlist_id, **timing}
+                    for playlist_id, timing in self.playlists.items()
+                ),
+                key=lambda timing: timing["wall_time"],
+                reverse=True,
+            ),
+            "memory": {
+                "peak_bytes": peak_memory,
+                "top_allocators": [
+                    {
+                        "location": str(statistic.traceback),
+                        "size_bytes": statistic.size,
+                        "count": statistic.count,
+                    }
+                    for statistic in snapshot.statistics("lineno")[
+                        : self.top_allocators
+                    ]
+                ],
+            },
+        }
+
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            if self.profile:
+                report["cprofile"] = os.path.join(self.report_dir, f"{run_name}.prof")
+                self.profile.dump_stats(report["cprofile"])
+                self.profile = None
+
+            report_path = os.path.join(self.report_dir, f"{run_name}.json")
+            with open(report_path, "w", encoding="utf-8") as report_file:
+                json.dump(report, report_file, indent=2)
+        except OSError as e:
+            logging.warning(
+                f"Failed to write profiling report to {self.report_dir}: {e}"
+            )
+            return None
+
+        logging.info(
+            f"Profiling report written to {report_path}: {report['wall_time']:.1f}s, "
+            f"peak traced memory {peak_memory / 2**20:.1f} MiB"
+        )
+        return report_path
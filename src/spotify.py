@@ -1,10 +1,17 @@
 import base64
 import logging
-import requests
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from urllib.parse import urlparse
+from identity import IdentityMap
+from metrics import HTTP_CACHE, HTTP_RETRIES
+from transport import HttpTransport, TokenBucket
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SpotifyArtist:
     _id: str
     name: str
@@ -13,7 +20,7 @@ class SpotifyArtist:
         return f"SpotifyArtist(id='{self._id}', name='{self.name}')"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SpotifyAlbum:
     _id: str
     title: str
@@ -25,7 +32,7 @@ class SpotifyAlbum:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SpotifyTrack:
     _id: str
     title: str
@@ -37,11 +44,12 @@ class SpotifyTrack:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SpotifyPlaylist:
     _id: str
     name: str
-    tracks: list[SpotifyTrack]
+    tracks: tuple[SpotifyTrack, ...]
+    snapshot_id: str | None = None
 
     def __str__(self):
         track_count = len(self.tracks)
@@ -49,16 +57,48 @@ class SpotifyPlaylist:
 
 
 class SpotifyService:
-    def __init__(self, client_id, client_secret):
+    TRACKS_PAGE_SIZE = 100
+    TRACKS_FIELDS = "total,next,items(track(id,name,album(id,name),artists(id,name)))"
+
+    TOKEN_REFRESH_MARGIN = 60
+
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        transport=None,
+        max_concurrency=4,
+        rate_limit=10.0,
+        rate_burst=20,
+        max_retries=5,
+        playlist_prefetch=4,
+        cache=None,
+        api_url="https://api.spotify.com",
+        accounts_url="https://accounts.spotify.com",
+    ):
         logging.debug("Initializing SpotifyService...")
         self.client_id = client_id
         self.client_secret = client_secret
-        self.token = self._get_access_token()
+        self.api_url = api_url
+        self.accounts_url = accounts_url
+        self.transport = (transport or HttpTransport()).for_service("spotify")
+        self.max_concurrency = max_concurrency
+        # Caps requests in flight across every thread and playlist stream.
+        self.request_semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.playlist_prefetch = max(1, playlist_prefetch)
+        self.rate_limiter = TokenBucket(rate_limit, rate_burst)
+        self.cache = cache
+        self.max_retries = max_retries
+        self.token_lock = threading.Lock()
+        self.token = None
+        self.token_expires_at = 0.0
+        self.identity_map = IdentityMap()
+        self._refresh_token()
 
     def _get_access_token(self):
         """Authenticate with Spotify API and get access token."""
         logging.info("Authenticating with Spotify API...")
-        auth_url = "https://accounts.spotify.com/api/token"
+        auth_url = f"{self.accounts_url}/api/token"
 
         auth_string = f"{self.client_id}:{self.client_secret}"
         auth_bytes = auth_string.encode("utf-8")
@@ -67,39 +107,147 @@ class SpotifyService:
         auth_data = {"grant_type": "client_credentials"}
 
         logging.debug(f"Requesting access token with client ID: {self.client_id}")
-        response = requests.post(auth_url, headers=auth_header, data=auth_data)
+        response = self.transport.post(auth_url, headers=auth_header, data=auth_data)
         response.raise_for_status()
 
-        token = response.json()["access_token"]
+        raw_token = response.json()
         logging.info("Successfully authenticated with Spotify API.")
-        logging.debug(f"Access token: {token}")
-        return token
+        logging.debug(f"Access token: {raw_token['access_token']}")
+        return raw_token["access_token"], raw_token.get("expires_in", 3600)
+
+    def _refresh_token(self, rejected_token=None):
+        with self.token_lock:
+            # Another thread may already have replaced an expired or rejected token.
+            if self.token != rejected_token and time.time() < self.token_expires_at:
+                return
+
+            self.token, expires_in = self._get_access_token()
+            self.token_expires_at = time.time() + expires_in - self.TOKEN_REFRESH_MARGIN
+
+    def _get(self, url, params=None, endpoint=None):
+        """GET a Spotify API URL, refreshing the token and honouring 429s.
+
+        With a cache, fresh entries are served without a request and stale
+        ones are revalidated with a conditional request.
+        """
+        endpoint = endpoint or urlparse(url).path
+        cache_key = entry = None
+        validators = {}
+        if self.cache:
+            cache_key = self.cache.cache_key(url, params)
+            entry = self.cache.get(cache_key)
+            if entry and entry.is_fresh:
+                HTTP_CACHE.labels("spotify", endpoint, "fresh").inc()
+                return entry.response()
+            if entry:
+                validators = entry.validators
+
+        for attempt in range(self.max_retries + 1):
+            if time.time() >= self.token_expires_at:
+                self._refresh_token(rejected_token=self.token)
+
+            token = self.token
+            self.rate_limiter.acquire()
+            with self.request_semaphore:
+                response = self.transport.get(
+                    url,
+                    headers={"Authorization": f"Bearer {token}", **validators},
+                    params=params,
+                    endpoint=endpoint,
+                )
 
-    def _load_playlist_from_raw(self, raw_playlists):
-        logging.debug("Loading playlists from raw data...")
-        playlists = []
-        for raw_playlist in raw_playlists.get("items", []):
-            tracks = []
-
-            tracks_url = raw_playlist["tracks"]["href"]
-            logging.info(f'Fetching tracks for playlist: {raw_playlist["name"]}')
-            response = requests.get(
-                tracks_url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            response.raise_for_status()
-            raw_tracks = response.json().get("items", [])
-            logging.debug(
-                f"Fetched {len(raw_tracks)} tracks for playlist '{raw_playlist['name']}'"
-            )
+            if response.status_code == 401:
+                logging.info("Spotify access token rejected, refreshing it.")
+                HTTP_RETRIES.labels("spotify", endpoint).inc()
+                self._refresh_token(rejected_token=token)
+            elif response.status_code == 429 and attempt < self.max_retries:
+                HTTP_RETRIES.labels("spotify", endpoint).inc()
+                retry_after = float(response.headers.get("Retry-After", 1))
+                logging.warning(
+                    f"Spotify rate limit hit, retrying in {retry_after}s ({attempt + 1}/{self.max_retries})."
+                )
+                self.rate_limiter.pause(retry_after)
+            else:
+                break
+
+        if entry and response.status_code == 304:
+            logging.debug(f"Spotify response for {cache_key} not modified.")
+            HTTP_CACHE.labels("spotify", endpoint, "revalidated").inc()
+            self.cache.renew(entry, response)
+            return entry.response()
+
+        response.raise_for_status()
+        if self.cache:
+            HTTP_CACHE.labels("spotify", endpoint, "miss").inc()
+            self.cache.store(cache_key, endpoint, response)
+        return response
+
+    def clear_identity_map(self):
+        logging.debug(
+            f"Clearing {len(self.identity_map)} interned Spotify artists and albums."
+        )
+        self.identity_map.clear()
+
+    def _get_tracks_page(self, playlist_id, offset=0, url=None):
+        if url is None:
+            url = f"{self.api_url}/v1/playlists/{playlist_id}/tracks"
+            params = {
+                "fields": self.TRACKS_FIELDS,
+                "limit": self.TRACKS_PAGE_SIZE,
+                "offset": offset,
+            }
+        else:
+            params = None
+
+        logging.debug(
+            f"Fetching tracks page for playlist {playlist_id} at offset {offset}"
+        )
+        return self._get(
+            url, params=params, endpoint="/v1/playlists/{playlist_id}/tracks"
+        ).json()
+
+    def _get_playlist_pages(self, playlist_id, page_executor):
+        """Fetch every track page of a playlist, the pages after the first in parallel."""
+        first_page = self._get_tracks_page(playlist_id)
+        offsets = range(
+            self.TRACKS_PAGE_SIZE,
+            first_page.get("total") or 0,
+            self.TRACKS_PAGE_SIZE,
+        )
+        pages = [
+            first_page,
+            *page_executor.map(
+                lambda offset: self._get_tracks_page(playlist_id, offset), offsets
+            ),
+        ]
+
+        # Follow next links if the playlist grew past the advertised total.
+        while pages[-1].get("next"):
+            pages.append(self._get_tracks_page(playlist_id, url=pages[-1]["next"]))
+
+        return pages
+
+    def _load_tracks_from_pages(self, pages):
+        tracks = []
+        for page in pages:
+            for raw_track_item in page.get("items", []):
+                raw_track = raw_track_item.get("track")
+                if not raw_track or not raw_track.get("id") or not raw_track["artists"]:
+                    logging.debug(f"Skipping unavailable track item: {raw_track_item}")
+                    continue
 
-            for raw_track_item in raw_tracks:
-                raw_track = raw_track_item["track"]
-                artist = SpotifyArtist(
-                    _id=raw_track["artists"][0]["id"],
-                    name=raw_track["artists"][0]["name"],
+                raw_artist = raw_track["artists"][0]
+                artist = self.identity_map.get(
+                    SpotifyArtist,
+                    (raw_artist["id"], raw_artist["name"]),
+                    _id=raw_artist["id"],
+                    name=raw_artist["name"],
                 )
 
-                album = SpotifyAlbum(
+                # Compilation tracks credit different artists on one album.
+                album = self.identity_map.get(
+                    SpotifyAlbum,
+                    (raw_track["album"]["id"], artist),
                     _id=raw_track["album"]["id"],
                     title=raw_track["album"]["name"],
                     artist=artist,
@@ -112,36 +260,99 @@ class SpotifyService:
                         album=album,
                     )
                 )
+        return tracks
+
+    def _filter_raw_playlists(self, raw_playlists, skip_playlist=None):
+        raw_playlists = [
+            raw_playlist
+            for raw_playlist in raw_playlists.get("items", [])
+            if raw_playlist
+        ]
+        if not skip_playlist:
+            return raw_playlists
+
+        filtered = []
+        for raw_playlist in raw_playlists:
+            if skip_playlist(raw_playlist["id"], raw_playlist.get("snapshot_id")):
+                logging.info(f'Skipping unchanged playlist: {raw_playlist["name"]}')
+            else:
+                filtered.append(raw_playlist)
+        return filtered
+
+    def _load_playlist(self, raw_playlist, pages):
+        tracks = self._load_tracks_from_pages(pages)
+        logging.debug(
+            f"Fetched {len(tracks)} tracks in {len(pages)} pages for playlist '{raw_playlist['name']}'"
+        )
+        logging.info(
+            f'Playlist {raw_playlist["name"]} loaded with {len(tracks)} tracks.'
+        )
+        return SpotifyPlaylist(
+            _id=raw_playlist["id"],
+            name=raw_playlist["name"],
+            tracks=tuple(tracks),
+            snapshot_id=raw_playlist.get("snapshot_id"),
+        )
 
-            playlists.append(
-                SpotifyPlaylist(
-                    _id=raw_playlist["id"],
-                    name=raw_playlist["name"],
-                    tracks=tracks,
-                )
-            )
-
-            logging.info(
-                f'Playlist {raw_playlist["name"]} loaded with {len(tracks)} tracks.'
-            )
+    def _iter_playlists_from_raw(self, raw_playlists, skip_playlist=None):
+        """Yield playlists in order as their tracks arrive.
 
-        logging.debug(f"Total playlists loaded: {len(playlists)}")
-        return playlists
+        Track pages are fetched for at most `playlist_prefetch` playlists
+        ahead of the consumer, so only those are held in memory at once.
+        """
+        logging.debug("Loading playlists from raw data...")
+        raw_playlists = self._filter_raw_playlists(raw_playlists, skip_playlist)
+
+        loaded = 0
+        pending = deque()
+        with ThreadPoolExecutor(
+            max_workers=self.playlist_prefetch
+        ) as playlist_executor, ThreadPoolExecutor(
+            max_workers=self.max_concurrency
+        ) as page_executor:
+            try:
+                for raw_playlist in raw_playlists:
+                    logging.info(
+                        f'Fetching tracks for playlist: {raw_playlist["name"]}'
+                    )
+                    pending.append(
+                        (
+                            raw_playlist,
+                            playlist_executor.submit(
+                                self._get_playlist_pages,
+                                raw_playlist["id"],
+                                page_executor,
+                            ),
+                        )
+                    )
+                    if len(pending) > self.playlist_prefetch:
+                        raw_pending, pages = pending.popleft()
+                        yield self._load_playlist(raw_pending, pages.result())
+                        loaded += 1
+
+                while pending:
+                    raw_pending, pages = pending.popleft()
+                    yield self._load_playlist(raw_pending, pages.result())
+                    loaded += 1
+            finally:
+                # Drop queued fetches when the consumer stops early.
+                for _, pages in pending:
+                    pages.cancel()
+
+        logging.debug(f"Total playlists loaded: {loaded}")
 
     def get_categories(self, limit, excluded_categories):
-        headers = {"Authorization": f"Bearer {self.token}"}
         fetched_categories = []
         processed_categories = set()
 
         logging.info("Fetching Spotify categories...")
         while len(fetched_categories) < limit:
-            url = "https://api.spotify.com/v1/browse/categories"
+            url = f"{self.api_url}/v1/browse/categories"
             params = {"limit": limit, "offset": len(processed_categories)}
             logging.debug(
                 f"Fetching categories with offset {len(processed_categories)}"
             )
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
+            response = self._get(url, params=params)
 
             categories = response.json().get("categories", {}).get("items", [])
             logging.debug(f"Fetched categories: {categories}")
@@ -172,40 +383,44 @@ class SpotifyService:
         logging.info(f"Total fetched categories: {len(fetched_categories)}")
         return fetched_categories
 
-    def get_playlists_for_artist(self, artist_name, limit):
+    def iter_playlists_for_artist(self, artist_name, limit, skip_playlist=None):
         logging.info(f"Searching for playlists for artist: {artist_name}")
-        url = f"https://api.spotify.com/v1/search"
-        headers = {"Authorization": f"Bearer {self.token}"}
+        url = f"{self.api_url}/v1/search"
         params = {"q": artist_name, "type": "playlist", "limit": limit}
 
         logging.debug(
             f"Searching playlists for artist '{artist_name}' with limit {limit}"
         )
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
+        response = self._get(url, params=params)
 
         raw_playlists = response.json().get("playlists", {})
         logging.info(
             f'Fetched {len(raw_playlists.get("items", []))} playlists for artist {artist_name}.'
         )
         logging.debug(f"Raw playlist data: {raw_playlists}")
-        return self._load_playlist_from_raw(raw_playlists)
+        yield from self._iter_playlists_from_raw(raw_playlists, skip_playlist)
 
-    def get_playlists_for_category(self, category_id, limit):
+    def iter_playlists_for_category(self, category_id, limit, skip_playlist=None):
         logging.info(f"Fetching playlists for category: {category_id}")
-        url = f"https://api.spotify.com/v1/browse/categories/{category_id}/playlists"
-        headers = {"Authorization": f"Bearer {self.token}"}
+        url = f"{self.api_url}/v1/browse/categories/{category_id}/playlists"
         params = {"limit": limit}
 
         logging.debug(
             f"Fetching playlists for category '{category_id}' with limit {limit}"
         )
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
+        response = self._get(
+            url, params=params, endpoint="/v1/browse/categories/{category_id}/playlists"
+        )
 
         raw_playlists = response.json().get("playlists", {})
         logging.info(
             f'Fetched {len(raw_playlists.get("items", []))} playlists for category {category_id}.'
         )
         logging.debug(f"Raw playlist data: {raw_playlists}")
-        return self._load_playlist_from_raw(raw_playlists)
+        yield from self._iter_playlists_from_raw(raw_playlists, skip_playlist)
+
+    def get_playlists_for_artist(self, artist_name, limit, skip_playlist=None):
+        return list(self.iter_playlists_for_artist(artist_name, limit, skip_playlist))
+
+    def get_playlists_for_category(self, category_id, limit, skip_playlist=None):
+        return list(self.iter_playlists_for_category(category_id, limit, skip_playlist))
@@ -0,0 +1,21 @@
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """Base of the SQLite stores kept between runs, shared by every thread.
+
+    Subclasses list their CREATE statements in SCHEMA and write under
+    `with self.lock, self.connection:`.
+    """
+
+    SCHEMA = ()
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import threading
+import time
+from utils import write_json_atomically
+
+
+class SyncStateStore:
+    """Persisted per-playlist sync state, keyed by Spotify playlist ID."""
+
+    def __init__(self, path, max_age=7 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.playlists = self._read()
+        logging.debug(f"Loaded sync state for {len(self.playlists)} playlists.")
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.path, encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable sync state {self.path}: {e}")
+            return {}
+
+    def is_unchanged(self, playlist_id, snapshot_id):
+        """True when the playlist was synced at this snapshot within max_age."""
+        with self.lock:
+            state = self.playlists.get(playlist_id)
+
+        return (
+            state is not None
+            and snapshot_id is not None
+            and state["snapshot_id"] == snapshot_id
+            and time.time() - state["synced_at"] < self.max_age
+        )
+
+    def navidrome_playlist_id(self, playlist_id):
+        with self.lock:
+            state = self.playlists.get(playlist_id)
+        return state and state.get("navidrome_playlist_id")
+
+    def record(self, playlist_id, snapshot_id, navidrome_playlist_id, track_ids):
+        with self.lock:
+            self.playlists[playlist_id] = {
+                "snapshot_id": snapshot_id,
+                "navidrome_playlist_id": navidrome_playlist_id,
+                "track_ids": track_ids,
+                "synced_at": time.time(),
+            }
+
+    def save(self):
+        with self.lock:
+            playlists = dict(self.playlists)
+
+        if write_json_atomically(self.path, playlists, "sync state"):
+            logging.debug(f"Saved sync state for {len(playlists)} playlists.")
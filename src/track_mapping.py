@@ -0,0 +1,100 @@
+import logging
+import time
+from matching import TrackMatcher
+from navidrome import NavidromeAlbum, NavidromeArtist, NavidromeTrack
+from sqlite_store import SqliteStore
+
+
+class TrackMappingStore(SqliteStore):
+    """SQLite store mapping Spotify track IDs to Navidrome songs across runs.
+
+    Tracks missing from Navidrome are stored as negative entries that are
+    trusted until their retry time. Entries made by another matcher version
+    are dropped when the store is opened.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS track_mappings ("
+        "spotify_id TEXT PRIMARY KEY, song_id TEXT, title TEXT, "
+        "artist_id TEXT, artist_name TEXT, album_id TEXT, retry_at REAL, "
+        "matcher_version INTEGER)",
+    )
+
+    def __init__(self, path, retry_after=12 * 3600, matcher_version=None):
+        logging.debug(f"Opening track mapping store at {path}")
+        super().__init__(path)
+        self.retry_after = retry_after
+        self.matcher_version = matcher_version or TrackMatcher.VERSION
+        with self.connection:
+            columns = {
+                row[1]
+                for row in self.connection.execute("PRAGMA table_info(track_mappings)")
+            }
+            if "matcher_version" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE track_mappings ADD COLUMN matcher_version INTEGER"
+                )
+            dropped = self.connection.execute(
+                "DELETE FROM track_mappings "
+                "WHERE matcher_version IS NULL OR matcher_version != ?",
+                (self.matcher_version,),
+            ).rowcount
+        if dropped:
+            logging.info(f"Dropped {dropped} track mappings made by an older matcher.")
+
+    def get(self, spotify_id):
+        """Return (found, track); track is None for a missing-track entry."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT song_id, title, artist_id, artist_name, album_id, retry_at "
+                "FROM track_mappings WHERE spotify_id = ?",
+                (spotify_id,),
+            ).fetchone()
+
+        if row is None:
+            return False, None
+
+        song_id, title, artist_id, artist_name, album_id, retry_at = row
+        if song_id is None:
+            return retry_at > time.time(), None
+
+        artist = NavidromeArtist(_id=artist_id, name=artist_name)
+        album = NavidromeAlbum(_id=album_id, artist=artist)
+        return True, NavidromeTrack(_id=song_id, title=title, album=album)
+
+    def set(self, spotify_id, track):
+        if track is None:
+            values = (
+                spotify_id,
+                None,
+                None,
+                None,
+                None,
+                None,
+                time.time() + self.retry_after,
+                self.matcher_version,
+            )
+        else:
+            artist = track.album.artist
+            values = (
+                spotify_id,
+                track._id,
+                track.title,
+                artist._id,
+                artist.name,
+                track.album._id,
+                None,
+                self.matcher_version,
+            )
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO track_mappings VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                values,
+            )
+
+    def invalidate(self, spotify_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM track_mappings WHERE spotify_id = ?", (spotify_id,)
+            )
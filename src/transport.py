@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import observe_request, status_class
+
+
+class HttpTransport:
+    """Shared HTTP transport with per-host keep-alive pools, timeouts and retries."""
+
+    IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        max_retries=3,
+        backoff_factor=0.5,
+    ):
+        logging.debug("Initializing HttpTransport...")
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=self.IDEMPOTENT_METHODS,
+            raise_on_status=False,
+            # 429s go back to the client, whose shared rate limiter must see them.
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        logging.debug(
+            f"HTTP pools: {pool_connections} hosts x {pool_maxsize} connections, "
+            f"timeout={self.timeout}, retries={max_retries}, backoff={backoff_factor}"
+        )
+
+    def for_service(self, service):
+        """Return a view of this transport labelling its metrics with `service`."""
+        return ServiceTransport(self, service)
+
+    def request(self, method, url, service="http", endpoint=None, **kwargs):
+        """Send a request; `endpoint` is the path template used in metrics."""
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint or urlparse(url).path
+        started_at = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            observe_request(
+                service, endpoint, method, "error", time.perf_counter() - started_at
+            )
+            raise
+
+        retries = getattr(response.raw, "retries", None)
+        observe_request(
+            service,
+            endpoint,
+            method,
+            status_class(response.status_code),
+            time.perf_counter() - started_at,
+            response_bytes=len(response.content),
+            retries=len(retries.history) if retries else 0,
+        )
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class ServiceTransport:
+    """HttpTransport view used by one service client, sharing its pools."""
+
+    def __init__(self, transport, service):
+        self.transport = transport
+        self.service = service
+
+    def request(self, method, url, **kwargs):
+        return self.transport.request(method, url, service=self.service, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every request to one API."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                refill_from = max(self.updated_at, min(now, self.paused_until))
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - refill_from) * self.rate
+                )
+                self.updated_at = now
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds`, e.g. after a 429 Retry-After."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
@@ -1,4 +1,8 @@
+import json
+import logging
 import os
+import re
+import unicodedata
 
 
 def get_env_variable(var_name, default=None):
@@ -13,3 +17,35 @@ def get_env_variable(var_name, default=None):
         )
 
     return value
+
+
+def write_json_atomically(path, data, description):
+    """Write data as JSON through a temporary file, so readers never see half of it.
+
+    Returns False, logging a warning naming `description`, when it fails.
+    """
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as json_file:
+            json.dump(data, json_file)
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        logging.warning(f"Failed to save {description} to {path}: {e}")
+        return False
+
+
+NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_name(name):
+    """Return a case, accent and punctuation insensitive key for a name."""
+    stripped = name or ""
+    if not stripped.isascii():
+        decomposed = unicodedata.normalize("NFKD", stripped)
+        stripped = "".join(
+            char for char in decomposed if not unicodedata.combining(char)
+        )
+    words = NON_WORD.sub(" ", stripped.casefold().replace("&", " and "))
+    return " ".join(words.split())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The application modules are flat files under src/, as in the Docker image.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
@@ -0,0 +1,131 @@
+import pytest
+from matching import TrackMatcher, parse_title, strip_title
+from navidrome import NavidromeAlbum, NavidromeArtist, NavidromeTrack
+
+
+@pytest.mark.parametrize(
+    "title, expected",
+    [
+        ("Come Together - Remastered 2009", ("Come Together", set())),
+        ("Come Together - 2019 Mix", ("Come Together", set())),
+        ("Under Pressure (feat. David Bowie)", ("Under Pressure", set())),
+        ("Stand By Me (with Ben E. King)", ("Stand By Me", set())),
+        ("Hey Jude (Live)", ("Hey Jude", {"live"})),
+        ("Hey Jude - Live at Wembley", ("Hey Jude", {"live"})),
+        ("Hello (Remix) [Remastered]", ("Hello", {"remix"})),
+        ("Yesterday - Take 2", ("Yesterday", set())),
+        ("Yesterday - Acoustic Version", ("Yesterday", {"acoustic"})),
+    ],
+)
+def test_strip_title_drops_version_suffixes(title, expected):
+    stripped, tags = strip_title(title)
+    assert (stripped, set(tags)) == expected
+
+
+@pytest.mark.parametrize(
+    "title",
+    [
+        "Take Five",
+        "Part 1",
+        "Hey Jude - The Beatles",
+        "Song (Part 2)",
+        "(Intro)",
+    ],
+)
+def test_strip_title_keeps_titles_that_are_not_versions(title):
+    assert strip_title(title) == (title, frozenset())
+
+
+def test_parse_title_normalizes_case_accents_and_punctuation():
+    assert parse_title("Beyoncé: Déjà Vu!") == ("beyonce deja vu", frozenset())
+    assert parse_title("Rock & Roll - Remastered")[0] == "rock and roll"
+
+
+def test_parse_title_falls_back_to_the_full_title():
+    assert parse_title("") == ("", frozenset())
+    assert parse_title("(Intro)")[0] == "intro"
+
+
+def make_track(song_id, title, artist_name="The Beatles", album_id="al1"):
+    artist = NavidromeArtist(_id="ar1", name=artist_name)
+    return NavidromeTrack(
+        _id=song_id, title=title, album=NavidromeAlbum(_id=album_id, artist=artist)
+    )
+
+
+@pytest.fixture
+def matcher():
+    matcher = TrackMatcher()
+    for track, album_title in [
+        (make_track("studio", "Hey Jude"), "Hey Jude"),
+        (make_track("live", "Hey Jude (Live)", album_id="al2"), "Live at the BBC"),
+        (make_track("part1", "Revolution Part 1"), "The White Album"),
+        (make_track("part2", "Revolution Part 2"), "The White Album"),
+        (make_track("together", "Come Together"), "Abbey Road"),
+    ]:
+        matcher.add(track, (track.album.artist.name,), album_title)
+    return matcher
+
+
+def match_id(matcher, artist_name, title, album_title=None):
+    track = matcher.match(artist_name, title, album_title)
+    return track._id if track else None
+
+
+def test_match_ignores_remaster_suffixes(matcher):
+    assert match_id(matcher, "The Beatles", "Come Together - Remastered 2009") == (
+        "together"
+    )
+
+
+def test_match_ignores_featured_artists(matcher):
+    assert match_id(matcher, "The Beatles feat. Billy Preston", "Hey Jude") == "studio"
+    assert match_id(matcher, "The Beatles", "Hey Jude (feat. Billy Preston)") == (
+        "studio"
+    )
+
+
+def test_match_keeps_live_and_studio_recordings_apart(matcher):
+    assert match_id(matcher, "The Beatles", "Hey Jude") == "studio"
+    assert match_id(matcher, "The Beatles", "Hey Jude - Live") == "live"
+
+
+def test_match_does_not_confuse_numbered_parts(matcher):
+    assert match_id(matcher, "The Beatles", "Revolution Part 1") == "part1"
+    assert match_id(matcher, "The Beatles", "Revolution Part 2") == "part2"
+    assert match_id(matcher, "The Beatles", "Revolution Part 3") is None
+
+
+def test_match_ignores_a_leading_the(matcher):
+    assert match_id(matcher, "Beatles", "Come Together") == "together"
+
+
+def test_match_tolerates_small_title_typos(matcher):
+    assert match_id(matcher, "The Beatles", "Come Togeter") == "together"
+
+
+def test_match_rejects_other_songs_and_artists(matcher):
+    assert match_id(matcher, "The Beatles", "Let It Be") is None
+    assert match_id(matcher, "The Rolling Stones", "Come Together") is None
+
+
+def test_match_prefers_the_same_album_on_ties():
+    matcher = TrackMatcher()
+    single = make_track("single", "Something", album_id="single")
+    album = make_track("album", "Something", album_id="abbey")
+    matcher.add(single, ("The Beatles",), "Something")
+    matcher.add(album, ("The Beatles",), "Abbey Road")
+
+    assert match_id(matcher, "The Beatles", "Something", "Abbey Road") == "album"
+    assert match_id(matcher, "The Beatles", "Something", "Something") == "single"
+
+
+def test_match_many_agrees_with_match(matcher):
+    queries = [
+        ("The Beatles", "Hey Jude - Live", None),
+        ("Beatles", "Come Together - Remastered 2009", "Abbey Road"),
+        ("The Beatles", "Let It Be", None),
+    ]
+    assert matcher.match_many(queries, processes=1) == [
+        matcher.match(*query) for query in queries
+    ]
@@ -0,0 +1,43 @@
+import pytest
+from navidrome import diff_playlist
+
+
+def apply_diff(current_ids, indexes_to_remove, ids_to_add):
+    """Apply a diff as Navidrome would: removals by index, then appends."""
+    kept = [
+        song_id
+        for index, song_id in enumerate(current_ids)
+        if index not in set(indexes_to_remove)
+    ]
+    return kept + ids_to_add
+
+
+@pytest.mark.parametrize(
+    "current_ids, desired_ids, expected",
+    [
+        ([], ["a", "b"], ([], ["a", "b"])),
+        (["a", "b"], ["a", "b"], ([], [])),
+        (["a", "b"], ["a", "b", "c"], ([], ["c"])),
+        (["a", "b", "c"], ["a", "c"], ([1], [])),
+        (["a", "b"], [], ([0, 1], [])),
+        (["x", "a", "b"], ["a", "b"], ([0], [])),
+        # Only appends are possible, so a reordered song is removed and re-added.
+        (["b", "a"], ["a", "b"], ([0], ["b"])),
+    ],
+)
+def test_diff_playlist(current_ids, desired_ids, expected):
+    assert diff_playlist(current_ids, desired_ids) == expected
+
+
+@pytest.mark.parametrize(
+    "current_ids, desired_ids",
+    [
+        (["a", "b", "c", "d"], ["b", "d", "e"]),
+        (["a", "a", "b"], ["a", "b", "b"]),
+        (["c", "b", "a"], ["a", "b", "c"]),
+    ],
+)
+def test_diff_playlist_produces_the_desired_playlist(current_ids, desired_ids):
+    assert apply_diff(current_ids, *diff_playlist(current_ids, desired_ids)) == (
+        desired_ids
+    )